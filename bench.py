@@ -0,0 +1,303 @@
+#!/usr/bin/python
+''' benchmarks for phplint.py and the de-cncrypto pipeline
+
+    python bench.py scaling    -- PHPParser.parse time against file size,
+                                  which should grow linearly
+    python bench.py nesting    -- PHPParser.parse on up to 10k deep nested
+                                  (expressions) and {blocks}, which should
+                                  also grow linearly
+    python bench.py lint [dir] -- PHPParser.parse throughput over the
+                                  decrypted outputs in dir (default: out/)
+    python bench.py pipeline [baseline.json [tolerance]]
+                               -- decrypt, lint and rename throughput over
+                                  a synthetic CNS corpus, compared with the
+                                  baseline (written there if it's missing),
+                                  failing if anything got more than
+                                  tolerance (default: 0.25) slower
+    python bench.py corpus dir -- write that synthetic corpus to dir, to run
+                                  de-cncrypto.py on it
+
+    with no arguments, every benchmark runs (not corpus, which only writes it).
+
+    baselines are only comparable on the same machine.
+'''
+from sys import argv
+from time import perf_counter
+from base64 import b64encode
+from random import Random
+import json
+import os.path
+from os import makedirs, walk
+from cncrypto import decrypt, rename_marked
+from maps import load_maps
+from phplint import PHPParser, ParseError
+
+SAMPLE_BLOCK = '''
+$_f26ec1be = "1.2.3";
+$html = "<table class=\\"stats\\"><tr><td>" . $value . "</td></tr></table>\\n";
+function _0e5ea304($lang, $_bfa4ce15 = "utf-8") {
+    global $_704910a1;
+    if ($lang == "ru") {
+        $_bfa4ce15 = "windows-1251";
+    } elseif ($lang == "en") {
+        $_bfa4ce15 = 'iso-8859-1';
+    } else {
+        $_bfa4ce15 = "utf-8";
+    }
+    for ($i = 0; $i < 10; $i++) {
+        $x .= "str \\"quoted\\" $i" . ($i * 2 + ($i / 3) % 4);
+    }
+    /* multi
+       line comment */
+    $r = mysql_query("SELECT * FROM cns_log WHERE id='" . $id . "'"); // query
+    return $_bfa4ce15;
+}
+'''
+
+def sample_php(blocks):
+    return '<?php\n' + SAMPLE_BLOCK * blocks + '?>\n'
+
+def time_parse(text, repeat=3, clean=True):
+    best = None
+    for _ in range(repeat):
+        parser = PHPParser(warn=False, clean=clean)
+        start = perf_counter()
+        parser.parse(text)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def scaling(sizes=(25, 50, 100, 200, 400, 800)):
+    ''' parse time per KB should stay flat as the file grows. '''
+    per_kb = []
+    print('%10s %10s %12s' % ('size (KB)', 'time (s)', 'us per KB'))
+    for blocks in sizes:
+        text = sample_php(blocks)
+        elapsed = time_parse(text)
+        kbytes = len(text) / 1024
+        per_kb.append(elapsed / kbytes)
+        print('%10.1f %10.4f %12.1f' % (kbytes, elapsed, per_kb[-1] * 1e6))
+
+    return check_linear(per_kb, sizes, 'KB')
+
+def check_linear(per_unit, sizes, unit):
+    growth = per_unit[-1] / per_unit[0]
+    print('time per %s grew %.2fx over a %ix size increase (%s)'
+          % (unit, growth, sizes[-1] // sizes[0], 'linear' if growth < 2 else 'NOT linear'))
+    return growth < 2
+
+# (name, source for a given depth, clean). the {blocks} are parsed without
+# cleanup, since re-indenting them makes the output itself quadratic.
+NESTED_SHAPES = [
+    ('(expression)', lambda depth: '<?php $x = ' + 'f(\n' * depth + '$a' + ')' * depth + ';', True),
+    ('{block}', lambda depth: '<?php ' + 'if ($a) {\n' * depth + '$a;' + '}' * depth, False),
+]
+
+def nesting(depths=(1250, 2500, 5000, 10000)):
+    ''' deep nesting must neither hit the recursion limit, nor get slower
+        per level. '''
+    ok = True
+    for name, source, clean in NESTED_SHAPES:
+        per_level = []
+        print('%-14s %8s %10s %12s' % ('shape', 'depth', 'time (s)', 'us per level'))
+        for depth in depths:
+            elapsed = time_parse(source(depth), repeat=1, clean=clean)
+            per_level.append(elapsed / depth)
+            print('%-14s %8i %10.4f %12.1f' % (name, depth, elapsed, per_level[-1] * 1e6))
+        ok = check_linear(per_level, depths, 'level') and ok
+    return ok
+
+def lint(directory='out'):
+    ''' parse every .php file under directory, report the throughput. '''
+    texts = []
+    for root, _, names in walk(directory):
+        for name in names:
+            if name.endswith('.php'):
+                with open(os.path.join(root, name)) as f:
+                    texts.append(f.read())
+    if not texts:
+        print('no .php files under %s' % directory)
+        return
+
+    start = perf_counter()
+    failed = 0
+    for text in texts:
+        try:
+            PHPParser(warn=False).parse(text)
+        except ParseError:
+            failed += 1
+    elapsed = perf_counter() - start
+    size = sum(map(len, texts)) / 1024 / 1024
+    print('%i files (%i failed), %.2f MB in %.3fs: %.2f MB/s'
+          % (len(texts), failed, size, elapsed, size / elapsed))
+
+####################################
+# the synthetic CNS corpus: php of each shape, at each size, encrypted with
+# the real layout: /*CNS + 6 digits + a 52 char translator + the base64 of
+# the source, translated with it*/
+
+BASE64_LETTERS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+def encrypt(source, seed):
+    ''' source (without its <?php) as a CNS encrypted file '''
+    translator = list(BASE64_LETTERS)
+    Random(seed).shuffle(translator)
+    translator = ''.join(translator)
+    payload = b64encode(source.encode()).decode()
+    payload = payload.translate(str.maketrans(translator, BASE64_LETTERS))
+    return ('<?php /*CNS%06i%s%s*/ eval(cns_decode(__FILE__)); ?>'
+            % (seed, translator, payload)).encode()
+
+def hashed_name(random):
+    ''' mostly names the maps know, so the renaming has work to do '''
+    known = sorted(load_maps().vm)
+    if random.random() < 0.6:
+        return random.choice(known)
+    return '$_%08x' % random.getrandbits(32)
+
+def strings_statement(random, depth):
+    return '%s = "<td class=\\"c%i\\">" . %s . \'</td>\\n\' . "%s {$x} \\"q\\"";\n' % (
+        hashed_name(random), random.randrange(99), hashed_name(random), 'text ' * random.randrange(1, 8))
+
+def operators_statement(random, depth):
+    operators = ['+', '-', '*', '/', '%', '.', '==', '!=', '&&', '||', '<=', '>=', '===', '<<']
+    terms = [hashed_name(random) for _ in range(random.randrange(3, 9))]
+    expression = terms[0]
+    for term in terms[1:]:
+        expression += ' %s %s' % (random.choice(operators), term)
+    return '%s .= %s->f(%s) + _5dddbc71::x;\n' % (hashed_name(random), expression, hashed_name(random))
+
+def nested_statement(random, depth):
+    ''' depth nested {blocks}, around depth nested (calls) '''
+    indent = ''
+    lines = []
+    for _ in range(depth):
+        lines.append('%sif (%s > %i) {' % (indent, hashed_name(random), random.randrange(9)))
+        indent += '    '
+    lines.append('%s%s = %s%s%s;' % (indent, hashed_name(random), 'f(' * depth,
+                                      hashed_name(random), ')' * depth))
+    for _ in range(depth):
+        indent = indent[4:]
+        lines.append(indent + '}')
+    return '\n'.join(lines) + '\n'
+
+# (shape, statement(random, depth), depth)
+CORPUS_SHAPES = [
+    ('strings', strings_statement, 0),
+    ('operators', operators_statement, 0),
+    ('nested-8', nested_statement, 8),
+    ('nested-32', nested_statement, 32),
+]
+CORPUS_SIZES = (4, 32, 256)  # KB of php per file
+
+def generate_corpus(sizes=CORPUS_SIZES):
+    ''' [(shape, name, encrypted bytes)], the same every time '''
+    corpus = []
+    seed = 0
+    for shape, statement, depth in CORPUS_SHAPES:
+        for size in sizes:
+            random = Random(seed)
+            source = ''
+            while len(source) < size * 1024:
+                source += statement(random, depth)
+            corpus.append((shape, '%s-%ik.php' % (shape, size), encrypt(source, seed)))
+            seed += 1
+    return corpus
+
+def corpus(directory):
+    ''' write the synthetic corpus to directory '''
+    makedirs(directory, exist_ok=True)
+    for _, name, data in generate_corpus():
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(data)
+    print('%i files written to %s' % (len(CORPUS_SHAPES) * len(CORPUS_SIZES), directory))
+
+def best_of(function, argument, repeat=5):
+    ''' (the result, the fastest time) of repeat calls '''
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = function(argument)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+# lint marks the names, rename renames them after, as de-cncrypto.py does
+PHASES = ('decrypt', 'lint', 'rename')
+
+def pipeline(baseline='bench-baseline.json', tolerance=0.25):
+    ''' MB/s of each phase, and files/s of all of them, per corpus shape.
+        anything more than tolerance slower than the baseline fails. '''
+    tolerance = float(tolerance)
+    maps = load_maps()
+    totals = {}
+    for shape, _, data in generate_corpus():
+        text, decrypt_time = best_of(decrypt, data)
+        code, lint_time = best_of(lambda text: PHPParser(warn=False, maps=maps,
+                                                         rename=False).parse(text), text)
+        _, rename_time = best_of(lambda code: rename_marked(code, maps, set()), code)
+        total = totals.setdefault(shape, {'files': 0, 'bytes': 0, 'decrypt': 0, 'lint': 0,
+                                          'rename': 0})
+        total['files'] += 1
+        total['bytes'] += len(text)
+        total['decrypt'] += decrypt_time
+        total['lint'] += lint_time
+        total['rename'] += rename_time
+
+    results = {}
+    for shape, total in totals.items():
+        mbytes = total['bytes'] / 1024 / 1024
+        results[shape] = {phase: mbytes / total[phase] for phase in PHASES}
+        results[shape]['files/s'] = total['files'] / sum(total[phase] for phase in PHASES)
+
+    previous = None
+    if os.path.exists(baseline):
+        with open(baseline) as f:
+            previous = json.load(f)
+
+    ok = True
+    columns = PHASES + ('files/s',)
+    print('%-10s' % 'shape' + ''.join('%16s' % (column if column == 'files/s' else column + ' MB/s')
+                                      for column in columns))
+    for shape, result in results.items():
+        line = '%-10s' % shape
+        for column in columns:
+            line += '%9.2f' % result[column]
+            if previous and shape in previous and column in previous[shape]:
+                ratio = result[column] / previous[shape][column]
+                line += ' %5.2fx' % ratio
+                if ratio < 1 - tolerance:
+                    line += '!'
+                    ok = False
+            else:
+                line += ' ' * 7
+        print(line)
+
+    if previous is None:
+        with open(baseline, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        print('baseline written to %s' % baseline)
+    else:
+        print('against %s: %s' % (baseline, 'ok' if ok else
+                                  'REGRESSION (! = more than %i%% slower)' % (tolerance * 100)))
+    return ok
+
+BENCHMARKS = {
+    'scaling': scaling,
+    'nesting': nesting,
+    'lint': lint,
+    'pipeline': pipeline,
+    'corpus': corpus,
+}
+
+if __name__ == '__main__':
+    if len(argv) > 1:
+        runs = [(argv[1], argv[2:])]
+    else:
+        # corpus only writes files (and needs a directory), it's not timed
+        runs = [(name, []) for name in BENCHMARKS if name != 'corpus']
+    ok = True
+    for name, args in runs:
+        print('== %s' % name)
+        ok = BENCHMARKS[name](*args) is not False and ok
+    exit(0 if ok else 1)
@@ -0,0 +1,501 @@
+'''
+    cncrypto.py - CNCrypto decryptor and CNStats deobfuscator, as a library.
+
+        decrypt(data) -> str                     CNS encrypted bytes to php
+        decompile(text, maps) -> Result          php_lint, renaming as it goes
+        decompile_file(path, outdir) -> FileResult
+
+    importing it has no side effects; de-cncrypto.py is the command line.
+'''
+from array import array
+from binascii import a2b_base64
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from hashlib import blake2b
+from mmap import mmap, ACCESS_READ
+from struct import Struct
+from time import perf_counter
+from os import makedirs, walk
+import os.path
+import json
+import re
+
+from maps import load_maps
+from phplint import NAME_MARK, PHPParser, ProfilingPHPParser, rename_text
+import phplint
+
+def blocks(chunks, size=1 << 16):
+    ''' the text of chunks, joined into blocks of about size characters
+        (and never split) '''
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= size:
+            yield "".join(pending)
+            pending = []
+            pending_size = 0
+    yield "".join(pending)
+
+# a name in the output of a PHPParser which isn't renaming
+MARKED = re.compile("%s([^%s]*)%s" % (NAME_MARK, NAME_MARK, NAME_MARK))
+
+def rename_marked(code, maps, renamed):
+    ''' code with its marked names renamed, $variables by maps.vm and the
+        rest by maps.fm, adding the names renamed to renamed '''
+    def rename(match):
+        name = match.group(1)
+        new_name = (maps.vm if name[0] == "$" else maps.fm).get(name)
+        if new_name is None or new_name == name:
+            return name
+        renamed.add(name)
+        return new_name
+    return MARKED.sub(rename, code)
+
+####################################
+# decrypting:
+
+base64_chars = b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+# everything a2b_base64 would skip, deleted up front so chunks stay 4-aligned
+not_base64_chars = bytes(c for c in range(256) if c not in base64_chars + b"0123456789+/=")
+chunk_size = 1 << 20 # base64 bytes decoded per step
+
+@lru_cache(maxsize=None)
+def translation_table(b64translator):
+    ''' many files share a translator, so build each table once '''
+    return bytes.maketrans(base64_chars, b64translator)
+
+def decrypt(data):
+    ''' decrypt CNS encrypted php (bytes, or a mmap of the file) to source,
+        decoding the payload in 4-aligned chunks, so only the output buffer
+        is ever held in full. files without a CNS header come back as is. '''
+    data_offset = data.find(b"/*")
+    data_offset = 0 if data_offset < 0 else data_offset + 2
+    data_end = data.find(b"*/", data_offset)
+    if data_end < 0:
+        data_end = len(data)
+
+    header_len = len("CNS")+6 # CNSnnnnnn (n = number)
+    header_offset = data_offset
+
+    base64_translator_offset = header_offset + header_len
+    base64_translator_len = 52
+
+    base64_offset = base64_translator_offset + base64_translator_len
+
+    if data[header_offset:header_offset + 3] != b"CNS":
+        # not encrypted, same as reading it in text mode
+        return str(data[:], "utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+    b64translator = data[base64_translator_offset:][:base64_translator_len]
+    table = translation_table(bytes(b64translator))
+
+    code = bytearray(b"<?php \n")
+    rest = b""
+    for offset in range(base64_offset, data_end, chunk_size):
+        chunk = rest + data[offset:min(offset + chunk_size, data_end)].translate(table, not_base64_chars)
+        aligned = len(chunk) - len(chunk) % 4
+        code += a2b_base64(chunk[:aligned])
+        rest = chunk[aligned:]
+    if rest:
+        code += a2b_base64(rest) # incomplete padding, raises like b64decode
+    return code.decode()
+
+@contextmanager
+def mapped_file(file):
+    ''' the file's bytes as a read-only mmap (or b"" for an empty file) '''
+    with open(file, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            yield b""
+        else:
+            with mmap(f.fileno(), 0, access=ACCESS_READ) as data:
+                yield data
+
+def decrypt_file(file):
+    with mapped_file(file) as data:
+        return decrypt(data)
+
+####################################
+# decompiling:
+
+# code: the decompiled source, linted: False if php_lint failed on it (and
+# it's only renamed), symbols: {"variables": SymbolTable, "words": ...},
+# diagnostics: the parser's Diagnostics.report() (counts per code, and the
+# first max_warnings warnings), renamed: names the maps renamed,
+# timings: {phase: seconds}, counters: the ProfilingPHPParser's counters
+# and the text's length (None unless profiling)
+Result = namedtuple("Result", "code linted symbols diagnostics renamed timings counters")
+
+def timed(chunks, timings, phase):
+    ''' chunks, adding the time it takes to get them to timings[phase] '''
+    while True:
+        start = perf_counter()
+        chunk = next(chunks, None)
+        timings[phase] += perf_counter() - start
+        if chunk is None:
+            return
+        yield chunk
+
+def decompile(text, maps=None, timings=None, max_warnings=None, profile=False, out=None,
+              tokens=None):
+    ''' php_lint text, renaming everything in maps (default: the built-in
+        ones) as it goes. timings of earlier phases can be passed in. with
+        out (a file), the code is written there as each top level statement
+        is done instead, and Result.code is None. with tokens (a
+        TokenWriter), the code before renaming is written there too, and
+        the renaming is done after linting. '''
+    maps = maps or load_maps()
+    timings = {**(timings or {}), "lint": 0}
+    pieces = []
+    write = pieces.append if out is None else out.write
+
+    parser = (ProfilingPHPParser if profile else PHPParser)(warn=False, maps=maps,
+                                                             max_warnings=max_warnings,
+                                                             rename=tokens is None)
+    renamed = parser.renamed
+    def rename(chunks):
+        if tokens is None:
+            yield from chunks
+            return
+        for block in blocks(chunks):
+            tokens.add(block)
+            yield rename_marked(block, maps, renamed)
+
+    writing = 0
+    def emit(codes):
+        nonlocal writing
+        for code in codes:
+            write_start = perf_counter()
+            write(code)
+            writing += perf_counter() - write_start
+
+    linted = True
+    start = perf_counter()
+    try:
+        chunks = timed(parser.parse_iter(text, streaming=out is not None), timings, "lint")
+        emit(rename(chunks))
+    except Exception as excp:
+        linted = False
+        parser.diagnostics.add("not-linted", parser.position, 1, f"{type(excp).__name__}: {excp}")
+        # start over, with the text as it is, only renamed
+        if out is None:
+            pieces = []
+            write = pieces.append
+        else:
+            out.seek(0)
+            out.truncate()
+        if tokens is not None:
+            tokens.restart()
+        renamed.clear()
+        writing = 0
+        start = perf_counter()
+        code, names = rename_text(text, maps, rename=tokens is None)
+        renamed.update(names)
+        emit(rename([code]))
+    if tokens is not None:
+        timings["rename"] = perf_counter() - start - writing - (timings["lint"] if linted else 0)
+
+    code = "".join(pieces) if out is None else None
+    symbols = {"variables": parser.variables, "words": parser.words}
+    diagnostics = parser.diagnostics.report(parser.line_col)
+    counters = {"length": len(text), **parser.counters} if profile else None
+    return Result(code, linted, symbols, diagnostics, renamed, timings, counters)
+
+# file: the input, result: its Result, without the code (None if it failed
+# or was skipped), error: why it failed, skipped: unchanged since the
+# cache_entry was written, renamed_only: only the maps changed, so it was
+# renamed again from its token cache, names: the hashed names in it (None if
+# it failed or was skipped)
+FileResult = namedtuple("FileResult", "file result error skipped cache_entry renamed_only names")
+
+def php_files(paths):
+    ''' the files in paths, with directories walked for *.php, in sorted
+        order so runs are reproducible '''
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in walk(path):
+                dirs.sort()
+                yield from (os.path.join(root, name) for name in sorted(names) if name.endswith(".php"))
+        else:
+            yield path
+
+def output_path(file, outdir="out"):
+    ''' file's path mirrored under outdir (absolute paths too, without
+        their root, so they can't end up overwriting the input) '''
+    return os.path.join(outdir, os.path.splitdrive(file)[1].lstrip(os.sep))
+
+def decompile_file(file, outdir="out", maps=None, cached=None, stamp=None, max_warnings=None,
+                   profile=False):
+    ''' decrypt -> php_lint (renaming) one file into outdir, keeping its
+        token cache there too. skipped if the cached entry shows the same
+        input, maps and tool version were already written there, and only
+        renamed again from the token cache if it shows just the maps
+        changed. without a cached entry, it's always decompiled. '''
+    maps = maps or load_maps()
+    try:
+        out_file = output_path(file, outdir)
+        tokens_file = output_path(file, os.path.join(outdir, ".tokens")) + ".tok"
+        makedirs(os.path.dirname(out_file), exist_ok=True)
+        makedirs(os.path.dirname(tokens_file), exist_ok=True)
+
+        with mapped_file(file) as data:
+            cache_entry = {"input": digest(data), **(stamp or cache_stamp(maps))}
+            if cache_entry == cached and os.path.exists(out_file):
+                return FileResult(file, None, None, True, cache_entry, False, None)
+
+            source = {"input": cache_entry["input"], "version": cache_entry["version"]}
+            maps_changed = (cached is not None and cached.get("maps") != cache_entry["maps"]
+                            and all(cached.get(key) == value for key, value in source.items()))
+            if maps_changed and not profile:
+                renamed = rename_file(tokens_file, out_file, maps, source)
+                if renamed:
+                    result, names = renamed
+                    return FileResult(file, result, None, False, cache_entry, True, names)
+
+            start = perf_counter()
+            text = decrypt(data)
+            timings = {"decrypt": perf_counter() - start}
+
+        if NAME_MARK in text:
+            # its names can't be told apart, so there's no token cache
+            with open(out_file, "w+") as f:
+                result = decompile(text, maps, timings, max_warnings, profile, out=f)
+            if os.path.exists(tokens_file):
+                os.unlink(tokens_file)
+            return FileResult(file, result, None, False, cache_entry, False,
+                              hashed_names(set(HASHED_NAME.findall(text))))
+
+        with open(out_file, "w+") as f, open(tokens_file + ".tmp", "wb") as tokens_f:
+            tokens = TokenWriter(tokens_f, source)
+            result = decompile(text, maps, timings, max_warnings, profile, out=f, tokens=tokens)
+            tokens.close(result.linted)
+        os.replace(tokens_file + ".tmp", tokens_file)
+    except Exception as excp:
+        return FileResult(file, None, f"{type(excp).__name__}: {excp}", False, None, False, None)
+    return FileResult(file, result, None, False, cache_entry, False, hashed_names(tokens.offsets))
+
+####################################
+# the token cache: the linted code before renaming, and where every name the
+# parser looked up is in it, so when only the maps change, only the renaming
+# has to be redone.
+# the file is the magic, the source it's for as a JSON line, the code, then
+# the names ("\n" separated), how often each one occurs, all their offsets
+# (grouped by name), and TOKENS_FOOTER. a name's kind is its leading $.
+
+TOKENS_MAGIC = b"CNSTOK1\0"
+TOKENS_FOOTER = Struct("<3Q?") # code bytes, names bytes, offsets, linted
+
+class TokenWriter(object):
+    ''' writes a token cache to f, a block of code at a time '''
+
+    def __init__(self, f, source):
+        self.f = f
+        f.write(TOKENS_MAGIC + json.dumps(source, sort_keys=True).encode() + b"\n")
+        self.code_start = f.tell()
+        self.restart()
+
+    def restart(self):
+        ''' drop everything added so far '''
+        self.f.seek(self.code_start)
+        self.f.truncate()
+        self.offsets = {} # name: array("I") of where it is
+        self.length = 0
+        self.code_bytes = 0
+
+    def add(self, block):
+        ''' the next block of code, with its names marked (see PHPParser),
+            which must not end inside a name '''
+        offsets = self.offsets
+        pieces = []
+        length = self.length
+        last = 0
+        for match in MARKED.finditer(block):
+            pieces.append(block[last:match.start()])
+            length += match.start() - last
+            name = match.group(1)
+            if name not in offsets:
+                offsets[name] = array("I")
+            offsets[name].append(length)
+            pieces.append(name)
+            length += len(name)
+            last = match.end()
+        pieces.append(block[last:])
+        encoded = "".join(pieces).encode()
+        self.f.write(encoded)
+        self.length = length + len(block) - last
+        self.code_bytes += len(encoded)
+
+    def close(self, linted):
+        names = "\n".join(self.offsets).encode()
+        counts = array("I", map(len, self.offsets.values()))
+        offsets = array("I")
+        for name_offsets in self.offsets.values():
+            offsets.extend(name_offsets)
+        self.f.write(names)
+        self.f.write(counts.tobytes())
+        self.f.write(offsets.tobytes())
+        self.f.write(TOKENS_FOOTER.pack(self.code_bytes, len(names), len(offsets), linted))
+
+# source: {"input", "version"} hashes it was made from, code: the linted
+# code before renaming, names: {name: array of offsets in code}
+Tokens = namedtuple("Tokens", "source code names linted")
+
+def load_tokens(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(TOKENS_MAGIC):
+        raise ValueError(f"{path} is not a token cache")
+    code_bytes, names_bytes, offsets_count, linted = TOKENS_FOOTER.unpack_from(
+        data, len(data) - TOKENS_FOOTER.size)
+    source_end = data.index(b"\n", len(TOKENS_MAGIC)) + 1
+    source = json.loads(data[len(TOKENS_MAGIC):source_end])
+    code = data[source_end:source_end + code_bytes].decode()
+
+    position = source_end + code_bytes
+    names = data[position:position + names_bytes].decode().split("\n") if names_bytes else []
+    position += names_bytes
+    counts = array("I", data[position:position + 4 * len(names)])
+    position += 4 * len(names)
+    offsets = array("I", data[position:position + 4 * offsets_count])
+
+    by_name = {}
+    start = 0
+    for name, count in zip(names, counts):
+        by_name[name] = offsets[start:start + count]
+        start += count
+    return Tokens(source, code, by_name, linted)
+
+def rename_tokens(tokens, maps):
+    ''' (tokens.code with maps applied, set of the names renamed), the same
+        as renaming while linting gives, by replacing only the names that
+        change '''
+    renames = {}
+    for name in tokens.names:
+        new_name = (maps.vm if name[0] == "$" else maps.fm).get(name)
+        if new_name is not None and new_name != name:
+            renames[name] = new_name
+    changed = [(offset, name) for name in renames for offset in tokens.names[name]]
+    changed.sort()
+    code = tokens.code
+    pieces = []
+    last = 0
+    for offset, name in changed:
+        pieces.append(code[last:offset])
+        pieces.append(renames[name])
+        last = offset + len(name)
+    pieces.append(code[last:])
+    return "".join(pieces), {name for _, name in changed}
+
+def rename_file(tokens_file, out_file, maps, source):
+    ''' write out_file from its token cache, if there's one for source.
+        (a Result without code, symbols or warnings, the hashed names in it),
+        or None if it has to be decompiled. '''
+    try:
+        tokens = load_tokens(tokens_file)
+    except (OSError, ValueError):
+        return None
+    if tokens.source != source:
+        return None
+
+    start = perf_counter()
+    code, renamed = rename_tokens(tokens, maps)
+    timings = {"rename": perf_counter() - start}
+    with open(out_file, "w") as f:
+        f.write(code)
+    diagnostics = {"counts": {}, "dropped": 0, "warnings": []}
+    return Result(None, tokens.linted, None, diagnostics, renamed, timings, None), hashed_names(tokens.names)
+
+####################################
+# the output cache: {output path: {"input", "maps", "version" hashes}}
+
+def cache_path(outdir="out"):
+    return os.path.join(outdir, ".cache.json")
+
+def digest(data):
+    return blake2b(data, digest_size=16).hexdigest()
+
+def maps_digest(renames):
+    return digest(json.dumps(renames, sort_keys=True).encode())
+
+def cache_stamp(maps=None):
+    ''' the part of a cache entry that's the same for every file: the
+        effective maps and the version (sources) of the tool itself '''
+    maps = maps or load_maps()
+    tool = b""
+    for source in (__file__, phplint.__file__):
+        with open(source, "rb") as f:
+            tool += f.read()
+    return {"maps": maps_digest({**maps.fm, **maps.vm}), "version": digest(tool)}
+
+def load_cache(outdir="out"):
+    try:
+        with open(cache_path(outdir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache, outdir="out"):
+    makedirs(outdir, exist_ok=True)
+    path = cache_path(outdir)
+    with open(path + ".tmp", "w") as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+####################################
+# the name index: {"maps": the effective maps of the last run, "files": the
+# output paths indexed, "names": {hashed name: [output paths it's in]}}, so
+# when the maps change, the files which have none of the changed names in
+# them can be left as they are.
+
+# CNStats' obfuscated names: "_" + crc32 of the original name
+HASHED_NAME = re.compile(r"(?<![\w$])\$?_[0-9a-f]{8}(?!\w)")
+
+def hashed_names(names):
+    return sorted(name for name in names if HASHED_NAME.fullmatch(name))
+
+def index_path(outdir="out"):
+    return os.path.join(outdir, ".names.json")
+
+def load_index(outdir="out"):
+    try:
+        with open(index_path(outdir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"maps": {}, "files": [], "names": {}}
+
+def save_index(index, outdir="out"):
+    makedirs(outdir, exist_ok=True)
+    path = index_path(outdir)
+    with open(path + ".tmp", "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def update_index(index, maps, file_names):
+    ''' index with the files in file_names ({output path: hashed names})
+        indexed again, and maps as the maps they were written with '''
+    names = {}
+    for name, paths in index["names"].items():
+        paths = [path for path in paths if path not in file_names]
+        if paths:
+            names[name] = paths
+    for path, path_names in file_names.items():
+        for name in path_names:
+            names.setdefault(name, []).append(path)
+    for paths in names.values():
+        paths.sort()
+    files = set(index["files"]).union(file_names)
+    return {"maps": {**maps.fm, **maps.vm}, "files": sorted(files), "names": names}
+
+def unaffected(index, maps):
+    ''' {output path: maps digest} of the indexed files the change from
+        the index's maps to maps doesn't rename anything in: any written
+        with the index's maps can be taken as written with these. '''
+    old, new = index["maps"], {**maps.fm, **maps.vm}
+    changed = {name for name in old.keys() | new.keys() if old.get(name) != new.get(name)}
+    if not all(HASHED_NAME.fullmatch(name) for name in changed):
+        return {} # not only hashed names, which aren't indexed
+    affected = {path for name in changed for path in index["names"].get(name, ())}
+    old_digest = maps_digest(old)
+    return {path: old_digest for path in index["files"] if path not in affected}
@@ -1,73 +1,298 @@
-from sys import argv
+from argparse import ArgumentParser
 from base64 import b64decode
-from functions_map import fm, vm
-from phplint import php_lint
+from concurrent.futures import ProcessPoolExecutor
+from cncrypto import decompile, decompile_file, decrypt, decrypt_file
+from cncrypto import php_files, output_path, cache_stamp, load_cache, save_cache
+from cncrypto import load_index, save_index, update_index, unaffected
+from maps import load_maps
+from phplint import diagnostics_text
+from glob import glob
+from itertools import repeat
+from signal import signal, SIGTERM
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+from threading import Condition
+from time import perf_counter
 import os.path
-from os import makedirs
+import json
+import sys
+from os import cpu_count
 
-if len(argv) < 2:
-    print("Usage: %s <file.php>" % (argv[0]))
-    exit(-1)
+map_paths = () # extra map layers on top of functions_map.py, see maps.py
 
-file = argv[1]
+def use_maps(paths):
+    ''' pick the map layers, for this process (and the pool's workers) '''
+    global map_paths
+    map_paths = tuple(paths)
 
-def apply_fm(code, fm):
-    maps = {**fm, **vm}
-    for func in maps:
-        func_readable = maps[func]
-        if func_readable == func:
-            continue
-        print(f"[function map] {func.__repr__()} -> {func_readable.__repr__()}")
-        code = code.replace(func, func_readable)
-    return code
-
-base64_chars = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
-
-def find_and_after(s,what):
-    y = s.find(what)
-    if y < 0:
-        return s
-    return s[y+len(what):]
-
-def find_and_before(s,what):
-    y = s.find(what)
-    if y < 0:
-        return s
-    return s[:y]
-
-outdir_path = os.path.join("out", os.path.dirname(file))
-if not os.path.exists(outdir_path):
-    makedirs(outdir_path)
-
-with open(file, "r") as f:
-    print(f"Decompiling {file}...")
-    text = f.read()
-    data = find_and_before(find_and_after(text, "/*"), "*/")
-    header_len = len("CNS")+6 # CNSnnnnnn (n = number)
-    header_offset = 0
-
-    base64_translator_offset = header_len
-    base64_translator_len = 52
-
-    base64_offset = base64_translator_offset + base64_translator_len
-
-    b64translator = data[base64_translator_offset:][:base64_translator_len]
-    header = data[header_offset:][:3]
-    code = data[base64_offset:]
-
-    with open(os.path.join(outdir_path, os.path.basename(file)), "w+") as f:
-        if header == "CNS":
-            code = "<?php \n" + b64decode(code.translate(str.maketrans(base64_chars, b64translator))).decode()
+def collect_files(paths):
+    ''' expand files, directories (walked for *.php) and glob patterns '''
+    files = []
+    for path in paths:
+        matches = glob(path, recursive=True) if any(c in path for c in "*?[") else [path]
+        files += php_files(sorted(matches))
+    # keep order, drop duplicates from overlapping arguments
+    return list(dict.fromkeys(files))
+
+def run_file(file, cached, stamp, max_warnings=None, profile=False):
+    ''' decompile_file with progress output, in a worker '''
+    maps = load_maps(map_paths)
+    file_result = decompile_file(file, "out", maps, cached, stamp, max_warnings, profile)
+    if file_result.skipped:
+        print(f"Unchanged {file}, skipping")
+    elif file_result.renamed_only:
+        print(f"Renamed {file} again, only the maps changed")
+    elif file_result.result:
+        print(f"Decompiled {file}")
+        # only the serious ones, the style warnings are in the counts
+        print(diagnostics_text(file_result.result.diagnostics, max_level=3), end="")
+        for func in sorted(file_result.result.renamed):
+            renamed = (maps.vm if func.startswith("$") else maps.fm)[func]
+            print(f"[function map] {func.__repr__()} -> {renamed.__repr__()}")
+    return file_result
+
+####################################
+# serve mode: a pool of warm workers answering JSON lines requests, on stdin
+# or a unix socket. a request is {"id": ..., "path": "file.php"} or
+# {"id": ..., "data": "<base64 of the file>"}, the response
+# {"id": ..., "ok": true, "code": ..., "linted": ..., "variables": [...],
+# "words": [...], "renamed": [...], "diagnostics": {...}, "timings": {...}} or
+# {"id": ..., "ok": false, "error": ...}, in the order they finish.
+
+def warm_up(paths):
+    ''' pool initializer: load the maps up front '''
+    use_maps(paths)
+    load_maps(map_paths)
+    sys.stdout = sys.stderr # stdout may be the response stream
+
+def handle_request(request):
+    try:
+        start = perf_counter()
+        if "path" in request:
+            text = decrypt_file(request["path"])
         else:
-       	    code = text
+            text = decrypt(b64decode(request["data"]))
+        timings = {"decrypt": perf_counter() - start}
+        result = decompile(text, load_maps(map_paths), timings)
+    except Exception as excp:
+        return {"id": request.get("id"), "ok": False, "error": f"{type(excp).__name__}: {excp}"}
+    return {"id": request.get("id"), "ok": True, "code": result.code, "linted": result.linted,
+            "variables": list(result.symbols["variables"]), "words": list(result.symbols["words"]),
+            "renamed": sorted(result.renamed), "diagnostics": result.diagnostics,
+            "timings": result.timings}
+
+def finished(future, request):
+    ''' the response of a finished request, an error one if its worker died. '''
+    try:
+        return future.result()
+    except Exception as excp:
+        return {"id": request.get("id"), "ok": False, "error": f"{type(excp).__name__}: {excp}"}
+
+def serve_stream(pool, lines, write):
+    ''' answer each JSON line from lines, through write(text). returns once
+        every response is written, not just worked out. '''
+    done = Condition()
+    outstanding = 0 # requests whose response isn't written yet
+    def respond(response):
+        nonlocal outstanding
+        with done:
+            try:
+                write(json.dumps(response) + "\n")
+            finally:
+                outstanding -= 1
+                done.notify_all()
+
+    for line in lines:
+        if not line.strip():
+            continue
+        with done:
+            outstanding += 1
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict) or not ("path" in request or "data" in request):
+                raise ValueError("expected {\"path\": ...} or {\"data\": ...}")
+        except ValueError as excp:
+            respond({"id": None, "ok": False, "error": f"bad request: {excp}"})
+            continue
+        try:
+            future = pool.submit(handle_request, request)
+        except Exception as excp: # the pool broke under an earlier request
+            respond({"id": request.get("id"), "ok": False, "error": f"{type(excp).__name__}: {excp}"})
+            continue
+        future.add_done_callback(lambda future, request=request: respond(finished(future, request)))
+    with done:
+        done.wait_for(lambda: outstanding == 0)
+
+def serve(pool, socket_path=None):
+    if socket_path is None:
+        def write(text):
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        serve_stream(pool, sys.stdin, write)
+        return
+
+    class Handler(StreamRequestHandler):
+        def handle(self):
+            def write(text):
+                self.wfile.write(text.encode())
+                self.wfile.flush()
+            serve_stream(pool, (line.decode() for line in self.rfile), write)
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    # stop on SIGTERM like on ^C, so the socket still gets removed
+    signal(SIGTERM, lambda signum, frame: sys.exit(0))
+    with ThreadingUnixStreamServer(socket_path, Handler) as server:
+        print(f"Serving on {socket_path}", file=sys.stderr)
         try:
-            print("Linting...")
-            code = php_lint(code, verbose=False)
-        except Exception:
+            server.serve_forever()
+        except KeyboardInterrupt:
             pass
+        finally:
+            os.unlink(socket_path)
+
+def print_summary(results):
+    failed = 0
+    print("Summary:")
+    for file, result, error, skipped, _, renamed_only, _ in results:
+        if error:
+            failed += 1
+            print(f"[FAIL] {file}: {error}")
+        elif skipped:
+            print(f"[OK]   {file} (unchanged)")
+        elif renamed_only:
+            print(f"[OK]   {file} (renamed again, only the maps changed)")
+        elif not result.linted:
+            print(f"[OK]   {file} (lint failed, written unformatted)")
+        else:
+            print(f"[OK]   {file}")
+    print(f"{len(results) - failed}/{len(results)} files decompiled, {failed} failed")
+
+    counts = {}
+    for file_result in results:
+        if file_result.result:
+            for code, count in file_result.result.diagnostics["counts"].items():
+                counts[code] = counts.get(code, 0) + count
+    if counts:
+        print("Warnings: " + ", ".join(f"{code} {count}" for code, count
+                                       in sorted(counts.items(), key=lambda item: -item[1])))
+    return failed
+
+def save_diagnostics(results, path):
+    ''' every file's Diagnostics.report(), as one JSON file '''
+    report = {file_result.file: file_result.result.diagnostics
+              for file_result in results if file_result.result}
+    with open(path, "w") as f:
+        json.dump(report, f, indent=1)
+
+PHASES = ("decrypt", "lint", "rename")
+
+def save_profile(results, path):
+    ''' {file: {"timings": {phase: seconds}, "counters": {...}}} as JSON '''
+    report = {file_result.file: {"timings": file_result.result.timings,
+                                 "counters": file_result.result.counters}
+              for file_result in results if file_result.result}
+    with open(path, "w") as f:
+        json.dump(report, f, indent=1)
+
+def print_profile(results, top=10):
+    ''' the top slowest files, with their time per phase '''
+    profiled = [file_result for file_result in results if file_result.result]
+    profiled.sort(key=lambda file_result: -sum(file_result.result.timings.values()))
+    print(f"Slowest {min(top, len(profiled))} of {len(profiled)} files (ms):")
+    print("   total " + "".join(f"{phase:>9}" for phase in PHASES) + "       KB  depth  file")
+    for file_result in profiled[:top]:
+        timings, counters = file_result.result.timings, file_result.result.counters
+        print(f"{sum(timings.values()) * 1000:8.1f} "
+              + "".join(f"{timings.get(phase, 0) * 1000:9.1f}" for phase in PHASES)
+              + f" {counters['length'] / 1024:8.1f} {counters['recursion_depth']:6}  {file_result.file}")
+    totals = {phase: sum(file_result.result.timings.get(phase, 0) for file_result in profiled)
+              for phase in PHASES}
+    print(f"{sum(totals.values()) * 1000:8.1f} "
+          + "".join(f"{totals[phase] * 1000:9.1f}" for phase in PHASES) + "           all files")
+
+def main():
+    parser = ArgumentParser(description="CNCrypto decryptor and CNStats deobfuscator")
+    parser.add_argument("paths", nargs="*", metavar="file.php|dir|glob",
+                        help="files, directories or glob patterns to decompile")
+    parser.add_argument("-j", "--jobs", type=int, default=cpu_count(),
+                        help="worker processes for batch mode (default: cpu count)")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="decompile even the files that are unchanged since the last run")
+    parser.add_argument("-m", "--map", action="append", default=[], dest="maps",
+                        help="JSON, TSV or compiled map file layered over functions_map.py (repeatable, later ones win)")
+    parser.add_argument("--max-warnings", type=int, default=100, metavar="N",
+                        help="keep at most N style warnings per file, the rest are only counted (default: 100)")
+    parser.add_argument("--diagnostics-json", metavar="PATH",
+                        help="write every file's warnings and warning counts to this JSON file")
+    parser.add_argument("--profile", nargs="?", const="profile.json", metavar="PATH",
+                        help="time each phase and count parser work per file, into this JSON file "
+                             "(default: profile.json), and show the slowest files; implies --force")
+    parser.add_argument("--serve", action="store_true",
+                        help="keep running, answering JSON lines requests on stdin (or --socket)")
+    parser.add_argument("--socket", metavar="PATH",
+                        help="with --serve, listen on this unix socket instead of stdin")
+    args = parser.parse_args()
+    if not args.paths and not args.serve:
+        parser.error("the following arguments are required: file.php|dir|glob")
+
+    use_maps(args.maps)
+    maps = load_maps(map_paths)
+    for conflict in maps.conflicts:
+        print(f"[function map] conflict: {conflict}", file=sys.stderr if args.serve else sys.stdout)
+
+    if args.serve:
+        with ProcessPoolExecutor(max_workers=max(1, args.jobs or 1),
+                                 initializer=warm_up, initargs=(map_paths,)) as pool:
+            serve(pool, args.socket)
+        return 0
+
+    files = collect_files(args.paths)
+    if not files:
+        print("No files found!")
+        return -1
+
+    fresh = args.force or args.profile
+    cache = {} if fresh else load_cache()
+    cached = [cache.get(output_path(file)) for file in files]
+    stamp = cache_stamp(maps)
+    # the files a map change renames nothing in count as written with these maps
+    index = load_index()
+    unchanged = {} if fresh else unaffected(index, maps)
+    for i, (file, entry) in enumerate(zip(files, cached)):
+        if (entry and entry["version"] == stamp["version"]
+                and unchanged.get(output_path(file)) == entry["maps"]):
+            cached[i] = {**entry, "maps": stamp["maps"]}
+
+    if len(files) == 1 and args.paths == files:
+        results = [run_file(files[0], cached[0], stamp, args.max_warnings, bool(args.profile))]
+    else:
+        with ProcessPoolExecutor(max_workers=max(1, args.jobs or 1),
+                                 initializer=use_maps, initargs=(map_paths,)) as pool:
+            results = list(pool.map(run_file, files, cached, repeat(stamp),
+                                    repeat(args.max_warnings), repeat(bool(args.profile)),
+                                    chunksize=8))
+
+    if fresh:
+        cache = load_cache()
+    for result in results:
+        if result.cache_entry:
+            cache[output_path(result.file)] = result.cache_entry
+    save_cache(cache)
+    save_index(update_index(index, maps, {output_path(result.file): result.names
+                                          for result in results if result.names is not None}))
+    if args.diagnostics_json:
+        save_diagnostics(results, args.diagnostics_json)
+    if args.profile:
+        save_profile(results, args.profile)
+        print_profile(results)
 
-        print("[WARN] function map is only changing function names while linting :(")
-        code = apply_fm(code, fm)
+    if len(results) == 1 and args.paths == files:
+        if results[0].error:
+            print(f"[FAIL] {results[0].file}: {results[0].error}")
+            return -1
+        print("Done!")
+        return 0
+    return -1 if print_summary(results) else 0
 
-        f.write(code)
-print("Done!")
+if __name__ == "__main__":
+    exit(main())
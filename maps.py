@@ -0,0 +1,187 @@
+'''
+    maps.py - the function (fm) and variable (vm) name maps, in layers.
+
+    functions_map.py is the built-in first layer. more layers can be loaded
+    from JSON ({"fm": {...}, "vm": {...}}) or TSV (name<TAB>readable, $names
+    go to vm) files, later layers overriding earlier ones. the merged maps
+    can be compiled into a binary file, which loads without merging again:
+
+        python maps.py compile -o maps.bin extra.json more.tsv
+        python maps.py check extra.json more.tsv
+'''
+from argparse import ArgumentParser
+from collections import namedtuple
+from functools import lru_cache
+from hashlib import blake2b
+from struct import Struct
+import json
+
+import functions_map
+
+# fm, vm: the maps, conflicts: [text] of everything that didn't merge cleanly
+Maps = namedtuple("Maps", "fm vm conflicts")
+
+####################################
+# the compiled form: a header, then for fm and vm each, an array of entries
+# sorted by name, which point into one blob of utf-8 strings, and the
+# conflicts found when it was compiled (as a JSON list). the header has a
+# digest of the built-in maps it was compiled with, since it has them merged
+# in. it's read into dicts in one go, lookups are on the hot path of parsing.
+
+MAGIC = b"CNSMAP4\0"
+HEADER = Struct("<8s16s6I") # magic, built-in maps digest, fm offset, vm offset,
+                            # blob offset, blob length, conflicts offset, conflicts length
+TABLE = Struct("<I") # entries
+ENTRY = Struct("<4I") # name offset, name length, readable offset, readable length
+
+def builtin_digest():
+    ''' a digest of functions_map.py's maps '''
+    maps = json.dumps([functions_map.fm, functions_map.vm], sort_keys=True)
+    return blake2b(maps.encode(), digest_size=16).digest()
+
+def compile_maps(maps, path):
+    ''' write maps (fm, vm and their conflicts) to path, in the compiled form '''
+    blob = bytearray()
+    strings = {}
+    def string(text):
+        if text not in strings:
+            strings[text] = len(blob)
+            blob.extend(text.encode())
+        return strings[text], len(text.encode())
+
+    tables = []
+    for table in (maps.fm, maps.vm):
+        names = sorted(table)
+        tables.append(TABLE.pack(len(names)) + b"".join(
+            ENTRY.pack(*string(name), *string(table[name])) for name in names))
+
+    conflicts = json.dumps(list(maps.conflicts)).encode()
+    fm_offset = HEADER.size
+    vm_offset = fm_offset + len(tables[0])
+    blob_offset = vm_offset + len(tables[1])
+    conflicts_offset = blob_offset + len(blob)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, builtin_digest(), fm_offset, vm_offset, blob_offset,
+                            len(blob), conflicts_offset, len(conflicts)))
+        f.write(tables[0] + tables[1] + blob + conflicts)
+
+def read_table(data, offset, blob):
+    ''' the {name: readable} of the table at offset '''
+    count, = TABLE.unpack_from(data, offset)
+    start = offset + TABLE.size
+    return {blob[name_offset:name_offset + name_length].decode():
+            blob[readable_offset:readable_offset + readable_length].decode()
+            for name_offset, name_length, readable_offset, readable_length
+            in ENTRY.iter_unpack(data[start:start + count * ENTRY.size])}
+
+def load_compiled(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a compiled maps file (or an older one, compile it again)")
+    (_, builtin, fm_offset, vm_offset, blob_offset, blob_length,
+     conflicts_offset, conflicts_length) = HEADER.unpack_from(data)
+    if builtin != builtin_digest():
+        raise ValueError(f"{path} was compiled with another functions_map.py, compile it again")
+    blob = data[blob_offset:blob_offset + blob_length]
+    conflicts = json.loads(data[conflicts_offset:conflicts_offset + conflicts_length])
+    return Maps(read_table(data, fm_offset, blob), read_table(data, vm_offset, blob), conflicts)
+
+####################################
+# the text forms:
+
+def load_json(path):
+    with open(path) as f:
+        layer = json.load(f)
+    unknown = set(layer) - {"fm", "vm"}
+    if unknown:
+        raise ValueError(f"{path}: unknown sections {sorted(unknown)}, expected fm and vm")
+    return Maps(layer.get("fm", {}), layer.get("vm", {}), [])
+
+def load_tsv(path):
+    fm, vm = {}, {}
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            if len(fields) != 2:
+                raise ValueError(f"{path}:{line_no}: expected name<TAB>readable")
+            name, readable = fields
+            (vm if name.startswith("$") else fm)[name] = readable
+    return Maps(fm, vm, [])
+
+def load_layer(path):
+    if path.endswith(".bin"):
+        return load_compiled(path)
+    if path.endswith(".tsv"):
+        return load_tsv(path)
+    return load_json(path)
+
+####################################
+# merging:
+
+def duplicate_names(maps):
+    ''' [text] for each readable name that more than one hash is renamed to '''
+    renamed_from = {}
+    for table in (maps.fm, maps.vm):
+        for name, readable in table.items():
+            if name != readable:
+                renamed_from.setdefault(readable, set()).add(name)
+    return [f"{', '.join(sorted(names))} all renamed to {readable}"
+            for readable, names in sorted(renamed_from.items()) if len(names) > 1]
+
+@lru_cache(maxsize=None)
+def load_maps(paths=()):
+    ''' the built-in maps, with the layers from paths (a tuple) on top.
+        a compiled file replaces everything below it, since it was
+        compiled from those layers (so it's a conflict when it isn't the
+        first one); if it's the last one its maps are used as they are. '''
+    maps = Maps(functions_map.fm, functions_map.vm, [])
+    compiled = False # whether maps are a compiled file's, as they are
+    for number, path in enumerate(paths):
+        layer = load_layer(path)
+        compiled = path.endswith(".bin")
+        if compiled:
+            replaced = [f"{path} replaces the layers before it: {', '.join(paths[:number])}"]
+            maps = layer._replace(conflicts=layer.conflicts + (replaced if number else []))
+            continue
+
+        conflicts = list(maps.conflicts)
+        merged = []
+        for table, overrides in ((maps.fm, layer.fm), (maps.vm, layer.vm)):
+            table = dict(table)
+            for name, readable in overrides.items():
+                if name in table and table[name] != readable:
+                    conflicts.append(f"{name}: {table[name]} overridden by {readable} ({path})")
+                table[name] = readable
+            merged.append(table)
+        maps = Maps(merged[0], merged[1], conflicts)
+
+    if compiled:
+        return maps # checked when it was compiled
+    # (a compiled layer below has its duplicates among its conflicts already)
+    duplicates = [duplicate for duplicate in duplicate_names(maps)
+                  if duplicate not in maps.conflicts]
+    return maps._replace(conflicts=maps.conflicts + duplicates)
+
+def main():
+    parser = ArgumentParser(description="check or compile layered name maps")
+    parser.add_argument("command", choices=("check", "compile"))
+    parser.add_argument("layers", nargs="*", help="JSON, TSV or compiled (.bin) map files, in order")
+    parser.add_argument("-o", "--output", default="maps.bin", help="compiled file to write (default: maps.bin)")
+    args = parser.parse_intermixed_args()
+
+    maps = load_maps(tuple(args.layers))
+    for conflict in maps.conflicts:
+        print(f"[conflict] {conflict}")
+    print(f"{len(maps.fm)} function names, {len(maps.vm)} variable names, {len(maps.conflicts)} conflicts")
+
+    if args.command == "compile":
+        compile_maps(maps, args.output)
+        print(f"Compiled to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
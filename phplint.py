@@ -23,8 +23,13 @@
 # pylint: disable=W0142 
 
 from __future__ import print_function
+import re
 import sys
-from functions_map import fm, vm
+from collections import namedtuple
+from types import GeneratorType
+from bisect import bisect_right
+from array import array
+from maps import load_maps
 
 # this could/should be expanded to full UTF-8 capacity:
 
@@ -38,6 +43,35 @@ OPERATORS = ['.', '+', '-', '*', '/', '&', '^', '%', '|', '?', ':', '=', '<' , '
 
 KEYWORD_BLOCK_THINGS = ['if' ,'do', 'for', 'else', 'while', 'elseif', 'switch', 'foreach', 'else if']
 
+# what string_literal scans for, for each quote mark:
+STRING_END = {'"': re.compile(r'["\\]'), "'": re.compile(r"['\\]")}
+
+# what line_col's newline index is built from:
+NEWLINE = re.compile('\n')
+
+# a word, from its first character:
+WORD_RUN = re.compile('[%s]+' % VALID_LETTERS)
+DIGITS = '0123456789'
+
+# the variables in a "string" (and the escapes, which they aren't after):
+INTERPOLATED = re.compile(r'\\.|\$[A-Za-z_][A-Za-z0-9_]*', re.S)
+
+# what the names are between, when a PHPParser isn't renaming them
+NAME_MARK = '\0'
+
+# operators by length, so the longest operator at a position is found with
+# at most three set lookups on the next 1-3 characters:
+OPERATORS_BY_LENGTH = [(n, frozenset(op for op in OPERATORS if len(op) == n))
+                       for n in (3, 2, 1)]
+OPERATOR_CHARS = frozenset(op[0] for op in OPERATORS)
+
+# the keywords to try for each first letter, in KEYWORD_BLOCK_THINGS order
+# (so that 'for' is still tried before 'foreach', etc.)
+KEYWORD_STARTS = {}
+for _keyword in KEYWORD_BLOCK_THINGS:
+    KEYWORD_STARTS.setdefault(_keyword[0], []).append(_keyword)
+del _keyword
+
 # TODO: also class, and function.
 
 class ParseError(Exception):
@@ -52,10 +86,225 @@ class PHPError(ParseError):
     ''' Invalid PHP, for some reason. '''
     pass
 
-class RollBack(Exception):
-    ''' this parse-attempt isn't working.
-    Please roll back to whereever you were. '''
-    pass
+class SymbolTable(object):
+    ''' insertion-ordered set of symbols, which also counts how often each
+        one occurs, and where (text position) it was first seen. '''
+
+    def __init__(self):
+        self.counts = {}
+        self.first_seen = {}
+
+    def add(self, name, position):
+        ''' record one occurrence of name. True if it's a new symbol. '''
+        if name in self.counts:
+            self.counts[name] += 1
+            return False
+        self.counts[name] = 1
+        self.first_seen[name] = position
+        return True
+
+    def __contains__(self, name):
+        return name in self.counts
+
+    def __iter__(self):
+        return iter(self.counts)
+
+    def __len__(self):
+        return len(self.counts)
+
+# what each diagnostic code means, '%s' is its detail:
+MESSAGES = {
+    'extra-newline': 'extra newline!',
+    'oddball-indentation': 'oddball indentation!',
+    'tab-not-space': "expected ' ', got TAB",
+    'expected-space': 'expected space!',
+    'semicolon-at-start': 'semicolon at beginning of <?php section.',
+    'space-before-semicolon': 'space before semicolon',
+    'empty-statement': 'semicolon without line of code!',
+    'space-before-comma': 'space before comma!',
+    'no-space-after-comma': 'no space after comma',
+    'no-space-before-operator': 'no space before %s',
+    'unbraced-block': '%s without {braced} section!',
+    'unclosed-expression': 'end of file inside (expression)',
+    'eof-outside-php': 'End of file OUTSIDE of <?php block...',
+    'non-renamed-variable': 'Non renamed variable %s!',
+    'non-renamed-function': 'Non renamed function %s!',
+    'not-linted': 'not linted, %s',
+}
+
+class Diagnostics(object):
+    ''' the warnings of one parse, as (code, position, level, detail)
+        tuples, and how often each code came up. past limit warnings only
+        the counts go up, except for the serious ones (level 3 and lower). '''
+
+    def __init__(self, limit=None):
+        self.entries = []
+        self.counts = {}
+        self.limit = limit
+
+    def add(self, code, position, level=5, detail=None):
+        self.counts[code] = self.counts.get(code, 0) + 1
+        if self.limit is None or len(self.entries) < self.limit or level <= 3:
+            self.entries.append((code, position, level, detail))
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def report(self, line_col):
+        ''' as plain data (for JSON, or to send between processes), with
+            positions turned into line:col by line_col(position) '''
+        warnings = []
+        for code, position, level, detail in self.entries:
+            line_no, chr_no = line_col(position)
+            message = MESSAGES[code] % detail if detail is not None else MESSAGES[code]
+            warnings.append({'code': code, 'level': level, 'line': line_no,
+                             'col': chr_no, 'message': message})
+        return {'counts': dict(self.counts), 'dropped': len(self) - len(self.entries),
+                'warnings': warnings}
+
+def diagnostics_text(report, max_level=None):
+    ''' a Diagnostics.report() as lines of text, only the warnings up to
+        max_level (lower is more serious) if given '''
+    lines = ['Warning(%i) [%i:%i]:  %s' % (warning['level'], warning['line'],
+                                          warning['col'], warning['message'])
+             for warning in report['warnings']
+             if max_level is None or warning['level'] <= max_level]
+    if report['dropped'] and max_level is None:
+        lines.append('... and %i more warnings' % report['dropped'])
+    return ''.join(line + '\n' for line in lines)
+
+####################################
+# the lexer: the whole text as a TokenStream, two parallel arrays (kind and
+# start) with one entry per token, instead of an object per slice. tokens
+# cover the text without gaps, so a token ends where the next one starts.
+
+(T_HTML, T_OPEN, T_CLOSE, T_SPACE, T_NEWLINE, T_COMMENT, T_STRING, T_VARIABLE,
+ T_NUMBER, T_WORD, T_OPERATOR, T_OTHER) = range(12)
+
+# one group per kind, in that order, tried in that order:
+LEXEME = re.compile('|'.join('(%s)' % pattern for pattern in (
+    r'(?:(?<=\?>)|\A)(?!<\?php)(?:.+?(?=<\?php)|.+)', # html, until <?php
+    r'<\?php',
+    r'\?>',
+    r'[ \t]+',
+    r'\n',
+    r'/(?:\*/|\*.*?\*/|\*.*)|//[^\n]*', # '/*/' is a whole comment, as in multiline_comment
+    r'"[^"\\]*(?:\\.[^"\\]*)*"|\'[^\'\\]*(?:\\.[^\'\\]*)*\'',
+    r'\$[A-Za-z0-9_]+',
+    r'[0-9][A-Za-z0-9_]*',
+    r'[A-Za-z_][A-Za-z0-9_]*',
+    '|'.join(re.escape(op) for op in sorted(OPERATORS, key=len, reverse=True)),
+    r'.')), re.S)
+
+class TokenStream(object):
+    ''' the tokens of a text: kinds[i] (T_...) and starts[i] of each '''
+    __slots__ = ('text', 'kinds', 'starts')
+
+    def __init__(self, text, kinds, starts):
+        self.text = text
+        self.kinds = kinds
+        self.starts = starts
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def end(self, index):
+        return self.starts[index + 1] if index + 1 < len(self.starts) else len(self.text)
+
+    def __getitem__(self, index):
+        ''' (kind, start, end) of a token '''
+        return self.kinds[index], self.starts[index], self.end(index)
+
+    def token_text(self, index):
+        return self.text[self.starts[index]:self.end(index)]
+
+def lex(text):
+    ''' text as a TokenStream '''
+    kinds = array('B')
+    starts = array('I')
+    add_kind, add_start = kinds.append, starts.append
+    for match in LEXEME.finditer(text):
+        add_kind(match.lastindex - 1)
+        add_start(match.start())
+    return TokenStream(text, kinds, starts)
+
+# the words which start a Node, with a {block} or a statement after them:
+NODE_KEYWORDS = frozenset(['function', 'if', 'do', 'for', 'else', 'while', 'elseif',
+                           'switch', 'foreach'])
+
+class Node(object):
+    ''' a part of a TokenStream: a {block} (kind '{'), or a function or
+        keyword block (kind is the word) up to the end of its {block} or
+        statement. start and end are token indexes. '''
+    __slots__ = ('kind', 'start', 'end', 'children')
+
+    def __init__(self, kind, start):
+        self.kind = kind
+        self.start = start
+        self.end = None
+        self.children = []
+
+    def __repr__(self):
+        return 'Node(%r, %i, %r, %r)' % (self.kind, self.start, self.end, self.children)
+
+    def walk(self):
+        ''' this node and all the ones inside it, depth first '''
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+def tree(tokens):
+    ''' the Node tree of a TokenStream, from a Node('file', 0) '''
+    root = Node('file', 0)
+    # the open nodes, as [node, parenthesis depth, its {block} is open]:
+    open_nodes = [[root, 0, True]]
+    depth = 0
+
+    def close(end):
+        ''' close the innermost node, and the keywords which it was the
+            whole statement of (so 'else if ... {}' ends with the if) '''
+        open_nodes.pop()[0].end = end
+        while not open_nodes[-1][2]:
+            open_nodes.pop()[0].end = end
+
+    text = tokens.text
+    for index, kind in enumerate(tokens.kinds):
+        if kind == T_WORD:
+            word = tokens.token_text(index)
+            if word in NODE_KEYWORDS:
+                node = Node(word, index)
+                open_nodes[-1][0].children.append(node)
+                open_nodes.append([node, depth, False])
+        elif kind == T_OTHER or kind == T_OPERATOR:
+            char = text[tokens.starts[index]]
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth = max(depth - 1, 0)
+            elif char == '{':
+                top = open_nodes[-1]
+                if not top[2] and top[1] == depth:
+                    top[2] = True
+                else:
+                    node = Node('{', index)
+                    top[0].children.append(node)
+                    open_nodes.append([node, depth, True])
+            elif char == '}':
+                if len(open_nodes) > 1:
+                    depth = open_nodes[-1][1]
+                    close(index + 1)
+            elif char == ';':
+                top = open_nodes[-1]
+                if not top[2] and top[1] == depth:
+                    close(index + 1)
+    for node, _, _ in reversed(open_nodes):
+        node.end = len(tokens)
+    return root
 
 ###############################################################3
 
@@ -63,8 +312,6 @@ class RollBack(Exception):
 class Parser(object):
     ''' a generic parser object. '''
 
-    line_no = 1
-    chr_no = 0
     text = ''
     position = 0
     text_length = 0
@@ -73,32 +320,45 @@ class Parser(object):
     k_and_r_braces = True
     indentation = '    '
 
-    def __init__(self, warn=True, clean=True):
+    def __init__(self, warn=True, clean=True, max_warnings=None):
         ''' constructor '''
 
         self.display_warnings = warn
         self.cleanup = clean
-        self.variables = []
-        self.words = []
+        self.variables = SymbolTable()
+        self.words = SymbolTable()
+        self.diagnostics = Diagnostics(max_warnings)
+        self.output = [] # the whole output, as chunks
+        self.newlines = None
 
     def step_back(self, count=1):
         ''' go back <count> characters '''
         self.position -= count
-        self.chr_no -= count
 
     def step_forward(self, count=1):
         ''' continue <count> number of characters '''
+        self.position = min(self.position + count, self.text_length)
 
-        for _ in range(count):
-            if self.position < self.text_length:
-                self.position += 1
+    def line_col(self, position=None):
+        ''' (line, column) of position (default: the current one). the
+            newline index is only built the first time it's needed. a
+            newline counts as column 0 of the line it starts. '''
+        if position is None:
+            position = self.position
+        if self.newlines is None:
+            self.newlines = [match.start() for match in NEWLINE.finditer(self.text)]
 
-            if self.next_chr_is('\n'):
-                self.line_no += 1
-                self.chr_no = 0
-            else:
-                self.chr_no += 1
+        newlines_before = bisect_right(self.newlines, position)
+        line_start = self.newlines[newlines_before - 1] if newlines_before else -1
+        return newlines_before + 1, position - line_start
 
+    @property
+    def line_no(self):
+        return self.line_col()[0]
+
+    @property
+    def chr_no(self):
+        return self.line_col()[1]
 
     def next_chr_is(self, char):
         ''' test if the next character to be parsed is char '''
@@ -117,10 +377,19 @@ class Parser(object):
         ''' test if the next text to be read starts with this text,
             and return it'''
         for text in texts:
-            if self.text[self.position:].startswith(text):
+            # startswith at an offset, so the rest of the file isn't copied
+            if self.text.startswith(text, self.position):
                 return text
         return False
 
+    def next_operator(self):
+        ''' the longest operator starting at the current position, or None '''
+        following = self.text[self.position:self.position + 3]
+        for length, operators in OPERATORS_BY_LENGTH:
+            if following[:length] in operators:
+                return following[:length]
+        return None
+
     def next_word_in(self, *words):
         word = self.next_starts(*words)
         if word and self.text[self.position + len(word)] not in VALID_LETTERS:
@@ -134,66 +403,160 @@ class Parser(object):
             at a time, and call the 'step_forward' function. '''
 
         if self.position < self.text_length - 1:
-            self.step_forward()
+            self.position += 1
             return True
         else:
             return False
 
-    def warn(self, text, level=5):
-        ''' display a warning message (usually to stderr) '''
-        if self.display_warnings:
-            print ("Warning(%i) [%i:%i]:  %s" % (level, self.line_no,
-                                                 self.chr_no, text),
-                                                 file=sys.stderr)
-
-    def rollback(self, output):
-        ''' return a 'with block' object which can be used to roll back from
-            attempted parsing. If a parse attempt fails, you should
-            raise RollBack. '''
-        output_len = len(output)
-        position = self.position
-        line_no = self.line_no
-        chr_no = self.chr_no
-
-        parser = self
-        output_list = output
-
-        class Roller(object):
-            ''' withblock object, which closes over the initial starting
-                position, so it can roll back to that if a RollBack is raised.
-            '''
-            def __enter__(self):
-                ''' start rollback block '''
-                pass
-            def __exit__(self, excptype, value, traceback):
-                ''' exit rollback block.  if a RollBack exception has been
-                    raised, roll back, and continue '''
-                if excptype == RollBack:
-                    while len(output_list) > output_len:
-                        output_list.pop()
-                    parser.position = position
-                    parser.line_no = line_no
-                    parser.chr_no = chr_no
-                    return True
-
-        return Roller()
+    def warn(self, code, level=5, detail=None):
+        ''' record a warning (see MESSAGES) at the current position. they're
+            only displayed (to stderr) once parsing is done. '''
+        self.diagnostics.add(code, self.position, level, detail)
+
+    def display_diagnostics(self):
+        if self.display_warnings and self.diagnostics.entries:
+            sys.stderr.write(diagnostics_text(self.diagnostics.report(self.line_col)))
+
+    def run(self, parsing):
+        ''' drive a parsing generator to its return value.
+
+            parsing functions which need to parse something nested (an
+            (expression), a {block}, ...) don't call each other directly,
+            they yield the nested parsing generator, and get its return
+            value back from the yield. the generators are kept on an
+            explicit stack here, so deep nesting costs heap, not C stack. '''
+        steps = self.run_iter(parsing)
+        while True:
+            try:
+                next(steps)
+            except StopIteration as done:
+                return done.value
+
+    def run_iter(self, parsing):
+        ''' run(), as a generator which passes on everything else a parsing
+            generator yields (output chunks, see php_section), and returns
+            the return value. '''
+
+        stack = [parsing]
+        value = None
+        error = None
+
+        while True:
+            try:
+                if error is None:
+                    nested = stack[-1].send(value)
+                else:
+                    nested = stack[-1].throw(error)
+                    error = None
+            except StopIteration as done:
+                stack.pop()
+                if not stack:
+                    return done.value
+                value = done.value
+                continue
+            except Exception as excp:  # pylint: disable=W0703
+                # pass it on to whatever is parsing around this
+                stack.pop()
+                if not stack:
+                    raise
+                error = excp
+                continue
+
+            if nested.__class__ is not GeneratorType:
+                yield nested
+                value = None
+                continue
+            stack.append(nested)
+            value = None
+
+
+class Section(object):
+    ''' the state of one php_section while it is being parsed. its output
+        is everything in the parser's output from start on. '''
+    __slots__ = ('indent', 'end_at_semicolon', 'basic_indent', 'start')
+
+    def __init__(self, indent, end_at_semicolon, start):
+        self.indent = indent
+        self.end_at_semicolon = end_at_semicolon
+        self.basic_indent = None
+        self.start = start
+
+
+def _dispatch_table(*entries):
+    ''' build a {character: handler name} table from (characters, name)
+        pairs. later entries don't override earlier ones. '''
+    table = {}
+    for chars, name in entries:
+        for char in chars:
+            table.setdefault(char, name)
+    return table
+
+# first-character dispatch, in the same order the checks used to be made:
+SECTION_DISPATCH = _dispatch_table(
+    ('?', 'section_question'),
+    (' \t', 'section_space'),
+    ('{', 'section_open_brace'),
+    ('}', 'section_close_brace'),
+    (';', 'section_semicolon'),
+    ('\n', 'section_newline'),
+    (',', 'section_comma'),
+    ('"\'', 'section_string'),
+    ('/', 'section_slash'),
+    (OPERATOR_CHARS, 'section_operator'),
+    ('$', 'section_variable'),
+    ('(', 'section_paren'),
+    (VALID_LETTERS, 'section_letter'))
+
+EXPRESSION_DISPATCH = _dispatch_table(
+    (')', 'expression_close'),
+    ('\n', 'expression_newline'),
+    ('(', 'expression_open'),
+    ('"\'', 'expression_string'),
+    ('$', 'expression_variable'),
+    ('/', 'expression_slash'),
+    (';,', 'expression_separator'),
+    (OPERATOR_CHARS, 'expression_operator'),
+    (' \t', 'expression_space'),
+    (VALID_LETTERS, 'expression_letter'))
 
 
 class PHPParser(Parser):  # pylint: disable=R0904
     ''' a PHP specific Parser object '''
 
+    def __init__(self, warn=True, clean=True, maps=None, max_warnings=None, rename=True):
+        super(PHPParser, self).__init__(warn, clean, max_warnings)
+
+        # function / variable names to rename, see maps.py, as they're
+        # output. without rename, the output keeps the original names, each
+        # one between two NAME_MARKs, for the caller to rename.
+        self.maps = maps or load_maps()
+        self.rename = rename
+        self.renamed = set() # the names which were renamed
+
+        self.section_handlers = {char: getattr(self, name)
+                                 for char, name in SECTION_DISPATCH.items()}
+        self.expression_handlers = {char: getattr(self, name)
+                                    for char, name in EXPRESSION_DISPATCH.items()}
+
     def string_literal(self):
         ''' read a string literal 'like this' or "like this", return it. '''
 
         initial_quote_mark = self.text[self.position]
         start_position = self.position
+        string_end = STRING_END[initial_quote_mark]
 
-        while self._not_at_end():
-            if self.next_chr_is('\\'):
-                self.step_forward()
-            elif self.next_chr_is(initial_quote_mark):
+        # jump from backslash to backslash until the closing quote:
+        search_from = start_position + 1
+        while True:
+            found = string_end.search(self.text, search_from)
+            if not found:
+                break
+            if found.group() == initial_quote_mark:
+                self.position = found.start()
                 return self.text[start_position:self.position + 1]
+            search_from = found.start() + 2  # skip the escaped character
 
+        self.position = self.text_length - 1
         raise UnexpectedEndOfFile('end of file inside string literal!')
 
     def multiline_comment(self):
@@ -201,11 +564,13 @@ class PHPParser(Parser):  # pylint: disable=R0904
 
         start = self.position
 
-        while self._not_at_end():
-            if self.next_starts('*/'):
-                self.step_forward()
-                return self.text[start:self.position + 1]
+        # (searching from the '*', so '/*/' is a whole comment, as it was)
+        end = self.text.find('*/', start + 1)
+        if end >= 0:
+            self.position = end + 1
+            return self.text[start:self.position + 1]
 
+        self.position = self.text_length - 1
         raise UnexpectedEndOfFile('end of file inside /* multi-line comment */')
 
     def inline_comment(self):
@@ -213,21 +578,23 @@ class PHPParser(Parser):  # pylint: disable=R0904
 
         start = self.position
 
-        while self._not_at_end():
-            if self.next_chr_is('\n'):
-                self.step_back()
-                break
-        return self.text[start:self.position + 1]
+        end = self.text.find('\n', start + 1)
+        if end < 0:
+            end = self.text_length
+        self.position = end - 1  # stop just before the newline
+        return self.text[start:end]
 
     def expression(self):  # pylint: disable=R0912
-        ''' a section of code (inside brackets). nestable / recursive. '''
-        output = ['(']
+        ''' a section of code (inside brackets), into self.output. nestable,
+            a parsing generator (see Parser.run). '''
+        output = self.output
+        output.append('(')
 
         # set indentation level to where this expression opens.
         if self.cleanup:
             previous_indent = self.current_indent
             previous_indentaton = self.indentation
-            self.current_indent = self.chr_no * ' '
+            self.current_indent = self.line_col()[1] * ' '
             self.indentation = ''
 
         if self.cleanup:
@@ -237,48 +604,117 @@ class PHPParser(Parser):  # pylint: disable=R0904
                     self.step_back()
                     break
 
+        handlers = self.expression_handlers
+        other = self.expression_other
+
         while self._not_at_end():
-            if self.next_chr_is(')'):
+            result = handlers.get(self.text[self.position], other)(output)
+            if result:
+                if result.__class__ is GeneratorType:
+                    yield result  # something nested
+                    continue
+                # reached the closing ')'
                 if self.cleanup:
                     while output[-1] in ' \t':
                         output.pop()
                     self.current_indent = previous_indent
                     self.indentation = previous_indentaton
                 output.append(')')
-                return ''.join(output)
+                return
 
-            elif self.next_chr_is('\n'):
-                output.append('\n')
-            elif self.next_chr_is('('):
-                output.append(self.expression())
-            elif self.next_chr_in('"\''):
-                output.append(self.string_literal())
-            elif self.next_chr_is('$'):
-                output.append(self.variable())
-            elif self.next_starts('/*'):
-                output.append(self.multiline_comment())
-            elif self.next_starts('//'):
-                output.append(self.inline_comment())
-                output.append(self.expect_space())
-            elif self.next_chr_is(';'):
-                output.append(';')
-                output.append(self.expect_space())
-            elif self.next_chr_is(','):
-                output.append(',')
-                output.append(self.expect_space())
-            elif self.next_starts(*OPERATORS):
-                self.output_operator(output)
-            elif self.next_chr_in(' \t'):
-                if self.cleanup:
-                    while output[-1] in ' \t':
-                        output.pop()
-                output.append(' ')
-            else:
-                output.append(self.text[self.position])
-
-        self.warn(output)
+        self.warn('unclosed-expression')
         raise UnexpectedEndOfFile('end of file inside (expression)')
 
+    ####################################
+    # expression_ functions: one per kind of character inside an
+    # (expression), picked from expression_handlers by the next character.
+    # they return True at the closing ')', or a parsing generator for
+    # something nested.
+
+    def expression_close(self, output):
+        ''' ')' ends the expression '''
+        return True
+
+    def expression_newline(self, output):
+        output.append('\n')
+
+    def expression_open(self, output):
+        yield self.expression()
+
+    def expression_string(self, output):
+        output.append(self.output_string(self.string_literal()))
+
+    def expression_variable(self, output):
+        output.append(self.variable())
+
+    def expression_slash(self, output):
+        ''' '/*', '//' or a '/' operator '''
+        if self.next_starts('/*'):
+            output.append(self.multiline_comment())
+        elif self.next_starts('//'):
+            output.append(self.inline_comment())
+            output.append(self.expect_space())
+        else:
+            self.expression_operator(output)
+
+    def expression_separator(self, output):
+        ''' ';' or ',' '''
+        output.append(self.text[self.position])
+        output.append(self.expect_space())
+
+    def expression_operator(self, output):
+        operator = self.next_operator()
+        if operator:
+            self.output_operator(output, operator)
+        else:
+            self.expression_other(output)
+
+    def expression_space(self, output):
+        if self.cleanup:
+            while output[-1] in ' \t':
+                output.pop()
+        output.append(' ')
+
+    def expression_letter(self, output):
+        ''' a word: a function, method or constant name, or a keyword. it's
+            not added to the words list, those are the statements' words. '''
+        start = self.position
+        end = WORD_RUN.match(self.text, start).end()
+        if end == self.text_length:
+            # it's an unclosed expression, which the expression finds out
+            output.append(self.text[start])
+            return
+        self.position = end - 1
+        word = self.text[start:end]
+        output.append(self.output_name(word, self.maps.fm.get(word)))
+
+    def expression_other(self, output):
+        output.append(self.text[self.position])
+
+    def output_name(self, name, new_name):
+        ''' what to output for a variable or word, which the maps rename to
+            new_name (None if they don't) '''
+        if not self.rename:
+            if name[0] in DIGITS:
+                return name # a number, never renamed
+            return NAME_MARK + name + NAME_MARK
+        if new_name is None or new_name == name:
+            return name
+        self.renamed.add(name)
+        return new_name
+
+    def output_string(self, literal):
+        ''' a string literal, with the variables in a "string" renamed. the
+            rest of a string is left alone. '''
+        if literal[0] != '"' or '$' not in literal:
+            return literal
+        def rename(match):
+            name = match.group()
+            if name[0] == '\\':
+                return name # an escaped character, maybe \$
+            return self.output_name(name, self.maps.vm.get(name))
+        return INTERPOLATED.sub(rename, literal)
+
     def variable(self):
         ''' read a $variable, add it to the variables list, and return it '''
         start = self.position
@@ -287,20 +723,14 @@ class PHPParser(Parser):  # pylint: disable=R0904
         while self._not_at_end():
             if not self.next_chr_in(VALID_LETTERS):
                 name = self.text[start:self.position]
-                varname = name
-                is_non_renamed = False
-                if name.startswith("$_") and name.lower() == name:
-                    varname = vm.get(name)
-                    if not varname:
-                        varname = name
-                        is_non_renamed = True
-
-                if not varname in self.variables:
-                    if is_non_renamed:
-                        print(f"Non renamed variable {name}!")
-                    self.variables.append(varname)
+                new_name = self.maps.vm.get(name)
+                is_non_renamed = (new_name is None and name.startswith("$_")
+                                  and name.lower() == name)
+
+                if self.variables.add(new_name or name, start) and is_non_renamed:
+                    self.diagnostics.add('non-renamed-variable', start, 3, name)
                 self.step_back()
-                return varname
+                return self.output_name(name, new_name)
 
         raise UnexpectedEndOfFile('end of file inside variable name!')
 
@@ -311,8 +741,7 @@ class PHPParser(Parser):  # pylint: disable=R0904
             if not self.next_chr_in(VALID_LETTERS):
                 self.step_back()
                 word = self.text[start:self.position + 1]
-                if not word in self.words:
-                    self.words.append(word)
+                self.words.add(word, start)
                 return word
 
         raise UnexpectedEndOfFile('end of file inside word.')
@@ -321,11 +750,12 @@ class PHPParser(Parser):  # pylint: disable=R0904
         ''' from ?> until we're back in <?php land... '''
         start = self.position
 
-        while self._not_at_end():
-            if self.next_starts('<?php'):
-                self.step_forward(4)
-                return self.text[start:self.position + 1]
+        php_start = self.text.find('<?php', start + 1)
+        if php_start >= 0:
+            self.position = php_start + 4
+            return self.text[start:self.position + 1]
 
+        self.position = self.text_length - 1
         raise UnexpectedEndOfFile ('End of file within PHP {} block!')
 
     def line_indent(self, blocklevel=0, basic_indent=None):
@@ -338,7 +768,7 @@ class PHPParser(Parser):  # pylint: disable=R0904
 
         while self._not_at_end():
             if self.next_chr_is('\n'):
-                self.warn('extra newline!')
+                self.warn('extra-newline')
                 linestart = self.position + 1
                 blanklines += '\n'
                 continue
@@ -346,7 +776,7 @@ class PHPParser(Parser):  # pylint: disable=R0904
                 this_indent = self.text[linestart:self.position]
                 if (blocklevel or basic_indent != None) and self.cleanup:
                     if self.current_indent != this_indent:
-                        self.warn('oddball indentation!')
+                        self.warn('oddball-indentation')
                 else:
                     self.current_indent = this_indent
 
@@ -393,14 +823,14 @@ class PHPParser(Parser):  # pylint: disable=R0904
                 if not output or not self.cleanup:
                     output.append(' ')
             elif self.next_chr_is('\t'):
-                self.warn("expected ' ', got TAB")
+                self.warn('tab-not-space')
                 if self.cleanup:
                     output.append(' ')
                 else:
                     output.append('\t')
             else:
                 if not output:
-                    self.warn('expected space!')
+                    self.warn('expected-space')
                     if self.cleanup:
                         output.append(' ')
 
@@ -412,14 +842,15 @@ class PHPParser(Parser):  # pylint: disable=R0904
     ####################################
     # output_ functions: which take the current 'output' list and modify
     #                    it directly, rather than simply parsing new stuff
-    #                    and returning it...
+    #                    and returning it... the ones which contain nested
+    #                    blocks are parsing generators (see Parser.run).
 
-    def output_curlyblock(self, output, indent):
+    def output_curlyblock(self, output, indent, start=0):
         ''' after reading a '{', add that and everything that follows into
-            the output list '''
+            the output list (whose current section starts at start) '''
 
         if self.cleanup:
-            if len(output) and output[-1] != ' ':
+            if len(output) > start and output[-1] != ' ':
                 output.append(' ')
 
         output.append('{')
@@ -429,27 +860,27 @@ class PHPParser(Parser):  # pylint: disable=R0904
             self.current_indent += self.indentation
             output.append(self.expect_newline())
 
-        output.append(self.php_section(indent + 1))
+        yield self.php_section(indent + 1)
 
         if self.cleanup:
             self.current_indent = old_indent
 
-    def output_semicolon(self, output):
+    def output_semicolon(self, output, start=0):
         ''' after reading a ';', add that to the output, as well as tidying up
-            any newline / hanging spaces / etc. '''
+            any newline / hanging spaces / etc. (back to start at most) '''
 
-        if not len(output):
-            self.warn('semicolon at beginning of <?php section.')
+        if len(output) == start:
+            self.warn('semicolon-at-start')
         else:
             if output[-1] in ' \t':
-                self.warn('space before semicolon')
+                self.warn('space-before-semicolon')
             elif output[-1] in ';\n':
-                self.warn('semicolon without line of code!')
+                self.warn('empty-statement')
 
         if self.cleanup:
-            while len(output) and output[-1] in '; \t\n':
+            while len(output) > start and output[-1] in '; \t\n':
                 output.pop()
-            if len(output):
+            if len(output) > start:
                 output.append(';')
 
             output.append(self.expect_newline())
@@ -461,25 +892,26 @@ class PHPParser(Parser):  # pylint: disable=R0904
             spaces, formatting, etc. '''
 
         if self.text[self.position - 1] == ' ':
-            self.warn('space before comma!')
+            self.warn('space-before-comma')
 
         output.append(',')
 
         if self.text[self.position + 1] != ' ':
-            self.warn('no space after comma')
+            self.warn('no-space-after-comma')
 
         if self.cleanup:
             output.append(' ')
 
-    def output_operator(self, output):
+    def output_operator(self, output, operator=None):
         ''' read an operator, add it to the output list, and check for spacing,
             etc. '''
 
-        operator = self.next_starts(*OPERATORS)
+        if operator is None:
+            operator = self.next_operator()
 
         if operator not in ('++', '--', '::', '->') \
         and self.text[self.position - 1] != ' ':
-            self.warn('no space before ' + operator)
+            self.warn('no-space-before-operator', detail=operator)
 
             if self.cleanup:
                 output.append(' ')
@@ -490,10 +922,10 @@ class PHPParser(Parser):  # pylint: disable=R0904
         if operator not in ('++', '--', '::', '->'):
             output.append(self.expect_space())
 
-    def output_clean_endbrace(self, output):
+    def output_clean_endbrace(self, output, start=0):
         ''' add the final } to a braced section, correcting the spacing. '''
 
-        if self.cleanup and output and self.k_and_r_braces:
+        if self.cleanup and len(output) > start and self.k_and_r_braces:
             if output[-1].endswith(self.indentation):
                 output[-1] = output[-1][0:-4]
         output.append('}')
@@ -515,16 +947,20 @@ class PHPParser(Parser):  # pylint: disable=R0904
             inside it's own new { pair of braces } '''
 
         if self.text[self.position] != '{':
-            self.warn(keyword + ' without {braced} section!')
+            self.warn('unbraced-block', detail=keyword)
             self.step_back()
             if self.cleanup:
                 output.append('{')
                 output.append('\n' + self.current_indent + self.indentation)
-                output.append(self.statement())
+                yield self.statement()
                 output.append('\n' + self.current_indent + '}')
             else:
                 self.step_back()
-                output.append(self.statement())
+                start = len(output)
+                yield self.statement()
+                # one item, like a {block} ends in one '}', for the checks
+                # of output[-1] which come after it
+                output[start:] = [''.join(output[start:])]
                 self.step_forward()
                 try:
                     if self.text[self.position] == '\n':
@@ -534,7 +970,7 @@ class PHPParser(Parser):  # pylint: disable=R0904
                 except IndexError:
                     self.step_back()
         else:
-            self.output_curlyblock(output, indent)
+            yield self.output_curlyblock(output, indent)
 
     def output_keyword_block(self, output, indent):
         ''' this will be for complex stuff like for loops, switches, etc, which
@@ -551,7 +987,7 @@ class PHPParser(Parser):  # pylint: disable=R0904
             if self.text[self.position] != '(':
                 raise PHPError('Expection (expression) after ' + keyword)
 
-            output.append(self.expression())
+            yield self.expression()
 
             if self.cleanup:
                 output.append(self.expect_space(strip_newlines=True))
@@ -560,21 +996,23 @@ class PHPParser(Parser):  # pylint: disable=R0904
         if not self.cleanup:
             self.step_forward()
 
-        self.output_curly_or_statement(output, indent, keyword)
+        yield self.output_curly_or_statement(output, indent, keyword)
 
-        if keyword in ('if', 'else if', 'elseif'):
-            with self.rollback(output):
-                output.append(self.expect_space(strip_newlines=True))
-                self.step_forward()
-
-                next_key = self.next_starts('elseif', 'else')
-                if next_key:
-                    self.output_keyword_block(output, indent)
-                else:
-                    raise RollBack()
+        if keyword in ('if', 'else if', 'elseif') and self.else_follows():
+            output.append(self.expect_space(strip_newlines=True))
+            self.step_forward()
+            yield self.output_keyword_block(output, indent)
 
         return True
 
+    def else_follows(self):
+        ''' does an else (or elseif) come next, past any spaces and newlines?
+            looked ahead, without parsing anything. '''
+        position = self.position + 1
+        while position < self.text_length and self.text[position] in ' \t\n':
+            position += 1
+        return self.text.startswith('else', position)
+
     def output_function_block(self, output, indent):
         ''' parse and output a function ... block. '''
         output.append('function')
@@ -585,24 +1023,24 @@ class PHPParser(Parser):  # pylint: disable=R0904
 
         if self.next_chr_is('('):
             # anonymous function!
-            output.append(self.expression())
+            yield self.expression()
             output.append(self.expect_space(strip_newlines=True))
             self.step_forward()
         else:
+            start = self.position
             function_name = self.word()
-            name = fm.get(function_name)
+            name = self.maps.fm.get(function_name)
             if name == None:
-                print(f"Non renamed function  {function_name}!")
-                name = function_name
+                self.diagnostics.add('non-renamed-function', start, 3, function_name)
             # named function
-            output.append(name)
+            output.append(self.output_name(function_name, name))
             # TODO: now can be followed by 'using', or block....
             output.append(self.expect_space(strip_newlines=True))
             if self.cleanup:
                 output.pop() # and remove that space...
 
             self.step_forward()
-            output.append(self.expression())
+            yield self.expression()
             self.step_back()
 
             if self.cleanup:
@@ -610,8 +1048,7 @@ class PHPParser(Parser):  # pylint: disable=R0904
 
         while self._not_at_end():
             if self.next_chr_is('{'):
-                block_output = []
-                self.output_curlyblock(block_output, indent)
+                yield self.output_curlyblock(output, indent, len(output))
                 break
 
             else:
@@ -619,129 +1056,283 @@ class PHPParser(Parser):  # pylint: disable=R0904
                     if self.next_chr_in('\n\t '):
                         output.append(self.text[self.position])
 
-        output.append(''.join(block_output))
-
 
     ####################################
     # the main parser functions:
 
-    def php_section(self, indent=0, end_at_semicolon=False):  # pylint: disable=R0912
+    def php_section(self, indent=0, end_at_semicolon=False, streaming=False):  # pylint: disable=R0912
         '''
-            parse / cleanup a php block. a block is either between
-            '<?php ... ?>' anything inside {}.  inside a {}, '?>...<?php' is
-            treated as part of the block, not as the end of the current one.
+            parse / cleanup a php block, into self.output. a block is either
+            between '<?php ... ?>' anything inside {}.  inside a {},
+            '?>...<?php' is treated as part of the block, not as the end of
+            the current one. when streaming (only for the top level one),
+            the output which is done is also yielded, after each statement.
         '''
 
-        output = []
-        basic_indent = None
-
-        while self._not_at_end():
-            if self.next_starts('?>'):
-                if not indent:
-                    if len(output) and output[-1] == basic_indent:
-                        output[-1] = '\n'
-                    self.step_forward()
-                    return ''.join(output)
-                else:
-                    output.append(self.inline_html())
-
-            elif self.next_chr_in(' \t') and not len(output):
-                self.output_initial_space(output, indent)
+        output = self.output
+        section = Section(indent, end_at_semicolon, len(output))
+        handlers = self.section_handlers
+        other = self.section_other
 
-            elif self.next_chr_is('{'):
-                self.output_curlyblock(output, indent)
-
-            elif self.next_chr_is('}'):
-                self.output_clean_endbrace(output)
-                return ''.join(output)
+        if streaming:
+            while self._not_at_end():
+                char = self.text[self.position]
+                result = handlers.get(char, other)(output, section)
+                if result:
+                    if result.__class__ is not GeneratorType:
+                        break
+                    yield result  # something nested
+                elif char != ';':
+                    continue
+                chunk = self.take_output(section)
+                if chunk:
+                    yield chunk
+            return
 
-            elif self.next_chr_is(';'):
-                self.output_semicolon(output)
-                if end_at_semicolon:
+        while self._not_at_end():
+            result = handlers.get(self.text[self.position], other)(output, section)
+            if result:
+                if result.__class__ is not GeneratorType:
                     break
+                yield result  # something nested
+
+    def take_output(self, section):
+        ''' remove and return the output which can't change anymore. that's
+            all of it, except for the section's last item which isn't a ';',
+            space or newline, and those after it: they can still be popped,
+            replaced or looked at (see output_semicolon). '''
+        output = self.output
+        keep = len(output) - 1
+        while keep >= section.start and output[keep] in '; \t\n':
+            keep -= 1
+        keep = max(keep, section.start)
+        chunk = ''.join(output[:keep])
+        del output[:keep]
+        section.start = 0
+        return chunk
 
-            elif self.next_chr_is('\n'):
-                output.append(self.line_indent(indent, basic_indent))
-                if basic_indent == None:
-                    basic_indent = output[-1]
+    ####################################
+    # section_ functions: one per kind of character inside a php_section,
+    # picked from section_handlers by the next character. they return True
+    # when the section is finished, or a parsing generator for something
+    # nested.
+
+    def section_question(self, output, section):
+        ''' '?>' ends the top level <?php section, otherwise an operator '''
+        if not self.next_starts('?>'):
+            return self.section_operator(output, section)
+
+        if not section.indent:
+            if len(output) > section.start and output[-1] == section.basic_indent:
+                output[-1] = '\n'
+            self.step_forward()
+            return True
+        output.append(self.inline_html())
 
-            elif self.next_chr_is(','):
-                self.output_comma(output)
+    def section_space(self, output, section):
+        if len(output) == section.start:
+            self.output_initial_space(output, section.indent)
+        else:
+            output.append(self.text[self.position])
 
-            elif self.next_chr_in('"\''):
-                output.append(self.string_literal())
+    def section_open_brace(self, output, section):
+        return self.output_curlyblock(output, section.indent, section.start)
 
-            elif self.next_starts('/*'):
-                output.append(self.multiline_comment())
+    def section_close_brace(self, output, section):
+        self.output_clean_endbrace(output, section.start)
+        return True
 
-            elif self.next_starts('//'):
-                output.append(self.inline_comment())
+    def section_semicolon(self, output, section):
+        self.output_semicolon(output, section.start)
+        return section.end_at_semicolon
 
-            elif self.next_starts(*OPERATORS):
-                self.output_operator(output)
+    def section_newline(self, output, section):
+        output.append(self.line_indent(section.indent, section.basic_indent))
+        if section.basic_indent == None:
+            section.basic_indent = output[-1]
 
-            elif self.next_chr_is('$'):
-                output.append(self.variable())
+    def section_comma(self, output, section):
+        self.output_comma(output)
 
-            elif self.next_chr_is('('):
-                output.append(self.expression())
+    def section_string(self, output, section):
+        output.append(self.output_string(self.string_literal()))
 
-            elif self.next_word_in(*KEYWORD_BLOCK_THINGS):
-                self.output_keyword_block(output, indent)
+    def section_slash(self, output, section):
+        ''' '/*', '//' or a '/' operator '''
+        if self.next_starts('/*'):
+            output.append(self.multiline_comment())
+        elif self.next_starts('//'):
+            output.append(self.inline_comment())
+        else:
+            self.section_operator(output, section)
 
-            elif self.next_word_in('function'):
-                self.output_function_block(output, indent)
+    def section_operator(self, output, section):
+        operator = self.next_operator()
+        if operator:
+            self.output_operator(output, operator)
+        else:
+            self.section_other(output, section)
 
-            elif self.next_chr_in(VALID_LETTERS):
-                output.append(self.word())
+    def section_variable(self, output, section):
+        output.append(self.variable())
 
-            else:
-                output.append(self.text[self.position])
+    def section_paren(self, output, section):
+        yield self.expression()
 
-        try:
-            return ''.join(output)
-        except:
-            print ('failed to join:', output)
-            raise
+    def section_letter(self, output, section):
+        ''' a keyword block, a function, or any other word '''
+        keywords = KEYWORD_STARTS.get(self.text[self.position])
+        if keywords and self.next_word_in(*keywords):
+            return self.output_keyword_block(output, section.indent)
+        elif self.next_chr_is('f') and self.next_word_in('function'):
+            return self.output_function_block(output, section.indent)
+        else:
+            word = self.word()
+            output.append(self.output_name(word, self.maps.fm.get(word)))
+
+    def section_other(self, output, section):
+        output.append(self.text[self.position])
 
     def parse(self, text):
         ''' the initial 'parse-a-php-file' function. Assumes that it is NOT
             starting inside a <?php block. '''
+        return ''.join(self.parse_iter(text, streaming=False))
+
+    def parse_iter(self, text, streaming=True):
+        ''' parse(), yielding the output in chunks as each top level statement
+            is done (or all of it at the end, when not streaming) '''
 
         self.text = text
         self.text_length = len(text)
         self.position = -1
-        self.line_no = 1
-        self.chr_no = 0
-
-
-        output = []
+        self.newlines = None
 
+        # everything is parsed into this one list, and joined when it's done
+        self.output = []
+        try:
+            yield from self.parse_into(self.output, streaming)
+        finally:
+            self.display_diagnostics()
+        yield ''.join(self.output)
+        self.output = []
+
+    def parse_into(self, output, streaming=False):
+        ''' parse self.text, appending to output, and yielding what
+            php_section yields '''
         while self._not_at_end():
             if self.next_starts('<?php'):
                 self.step_forward(4)
 
                 output.append('<?php')
 
-                php_block = self.php_section()
+                yield from self.run_iter(self.php_section(streaming=streaming))
 
-                output.append(php_block)
                 if self.position < len(self.text) and self.next_starts('>'):
                     output.append('?>')
             else:
                 try:
                     output.append(self.text[self.position])
                 except IndexError:
-                    self.warn('End of file OUTSIDE of <?php block...', 1)
+                    self.warn('eof-outside-php', 1)
                     break
 
-        return ''.join(output)
 
+class ProfilingPHPParser(PHPParser):
+    ''' a PHPParser which also counts what it does, in self.counters:
+        chars (stepped through one at a time), dispatch (handler: hits),
+        lookaheads (for an else) and recursion_depth (the deepest nesting).
+        PHPParser itself doesn't count anything, so it costs nothing there. '''
+
+    def __init__(self, *args, **kwargs):
+        super(ProfilingPHPParser, self).__init__(*args, **kwargs)
+        self.counters = {'chars': 0, 'dispatch': {}, 'lookaheads': 0, 'recursion_depth': 0}
+        self.section_handlers = {char: self._counted(SECTION_DISPATCH[char], handler)
+                                 for char, handler in self.section_handlers.items()}
+        self.expression_handlers = {char: self._counted(EXPRESSION_DISPATCH[char], handler)
+                                    for char, handler in self.expression_handlers.items()}
+        self.section_other = self._counted('section_other', self.section_other)
+        self.expression_other = self._counted('expression_other', self.expression_other)
+
+    def _counted(self, name, handler):
+        dispatch = self.counters['dispatch']
+        dispatch.setdefault(name, 0)
+        def counted(*args):
+            dispatch[name] += 1
+            return handler(*args)
+        return counted
 
-def php_lint(input_text: str, verbose = True) -> str:
+    def _not_at_end(self):
+        if super(ProfilingPHPParser, self)._not_at_end():
+            self.counters['chars'] += 1
+            return True
+        return False
+
+    def run_iter(self, parsing):
+        return super(ProfilingPHPParser, self).run_iter(self._tracked(parsing, 1))
+
+    def _tracked(self, parsing, depth):
+        ''' parsing, with the generators it nests wrapped too, to see how
+            deep the run() stack gets '''
+        counters = self.counters
+        counters['recursion_depth'] = max(counters['recursion_depth'], depth)
+        value = None
+        error = None
+        while True:
+            try:
+                if error is None:
+                    nested = parsing.send(value)
+                else:
+                    nested = parsing.throw(error)
+            except StopIteration as done:
+                return done.value
+            error = None
+            if nested.__class__ is not GeneratorType:
+                value = yield nested  # output, passed on
+                continue
+            try:
+                value = yield self._tracked(nested, depth + 1)
+            except Exception as excp:  # pylint: disable=W0703
+                value = None
+                error = excp
+
+    def else_follows(self):
+        self.counters['lookaheads'] += 1
+        return super(ProfilingPHPParser, self).else_follows()
+
+def rename_text(text, maps=None, rename=True):
+    ''' (text with its names renamed as a PHPParser would, without linting
+        it, the set of the names renamed), for the text which can't be
+        linted. by its tokens, so strings and comments stay as they are. '''
+    parser = PHPParser(warn=False, maps=maps, rename=rename)
+    fm, vm = parser.maps.fm, parser.maps.vm
+    tokens = lex(text)
+    pieces = []
+    for index, kind in enumerate(tokens.kinds):
+        token = tokens.token_text(index)
+        if kind == T_VARIABLE:
+            token = parser.output_name(token, vm.get(token))
+        elif kind == T_WORD:
+            token = parser.output_name(token, fm.get(token))
+        elif kind == T_STRING:
+            token = parser.output_string(token)
+        pieces.append(token)
+    return ''.join(pieces), parser.renamed
+
+def print_symbols(parser):
+    ''' the symbols table, with counts and first line:col, to stderr '''
+    for title, symbols in (('Variables', parser.variables), ('Words', parser.words)):
+        print(title + ':', ', '.join(
+            '%s (%ix, first at %i:%i)' % ((name, symbols.counts[name])
+                                          + parser.line_col(symbols.first_seen[name]))
+            for name in sorted(symbols)), file=sys.stderr)
+
+# code: the linted source, diagnostics: its Diagnostics.report()
+LintResult = namedtuple('LintResult', 'code diagnostics')
+
+def php_lint(input_text: str, verbose = True, maps = None, max_warnings = None) -> LintResult:
     output_text = input_text
 
-    p = PHPParser(warn=verbose)
+    p = PHPParser(warn=verbose, maps=maps, max_warnings=max_warnings)
     try:
         output_text = p.parse(input_text)
     except ParseError as excp:
@@ -752,8 +1343,23 @@ def php_lint(input_text: str, verbose = True) -> str:
         raise ParseError
 
     if verbose:
-        print('Variables:', sorted(p.variables), file=sys.stderr)
-        print('Words:', sorted(p.words), file=sys.stderr)
-    return output_text
-
+        print_symbols(p)
+    return LintResult(output_text, p.diagnostics.report(p.line_col))
+
+def php_lint_iter(input_text: str, verbose = True, maps = None, max_warnings = None):
+    ''' php_lint(), yielding the code in chunks as each top level statement
+        is done, so the whole of it is never held. returns (as in
+        StopIteration.value) the diagnostics report. '''
+    p = PHPParser(warn=verbose, maps=maps, max_warnings=max_warnings)
+    try:
+        yield from p.parse_iter(input_text)
+    except ParseError as excp:
+        print('Err:', excp, file=sys.stderr)
+        print('---------\n' +
+              input_text[0:p.position + 1] +
+              "<-------- there!\n", file=sys.stderr)
+        raise ParseError
 
+    if verbose:
+        print_symbols(p)
+    return p.diagnostics.report(p.line_col)
@@ -0,0 +1,179 @@
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from cncrypto import HASHED_NAME, php_files
+from maps import load_maps
+from hashlib import md5
+from itertools import islice, product, repeat
+from time import perf_counter
+from zlib import crc32
+from os import cpu_count
+import re
+
+# HASHED_NAME is "_" + crc32 of the original name (without the $), so
+# "$_8d93d649" is $user and "_5dddbc71" is error()
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+SCHEMES = ("crc32", "md5", "md5-tail")
+
+def collect(paths, maps):
+    ''' (unresolved hashed names, vocabulary) of the php files in paths. the
+        vocabulary is every identifier in the code and its strings (builtins,
+        CNStats' own names and texts), and their "_" separated parts. '''
+    known = {**maps.fm, **maps.vm}
+    unresolved = set()
+    words = set()
+    for file in php_files(paths):
+        with open(file) as f:
+            text = f.read()
+        unresolved |= {name for name in HASHED_NAME.findall(text) if name not in known}
+        words.update(IDENTIFIER.findall(text))
+
+    words.update(readable.lstrip("$") for readable in known.values())
+    vocabulary = set()
+    for word in words:
+        if HASHED_NAME.fullmatch(word):
+            continue
+        for part in [word] + word.split("_"):
+            if len(part) > 1:
+                vocabulary.update((part, part.lower()))
+    return unresolved, vocabulary
+
+####################################
+# the workers: each one gets a batch of prefixes, and tries every prefix
+# with every vocabulary word appended. prefixes are hashed once, and for
+# crc32 the whole batch of appended words is tested in one C level
+# map/isdisjoint pass, only rescanned for the (rare) prefixes with a hit.
+
+worker_vocabulary = None
+worker_targets = None
+
+def init_worker(vocabulary, targets):
+    global worker_vocabulary, worker_targets
+    worker_vocabulary = vocabulary
+    worker_targets = targets
+
+def crack(prefixes):
+    ''' returns ([(scheme, hash, candidate)], number of candidates tried) '''
+    hits = []
+    tried = 0
+    vocabulary = worker_vocabulary
+    crc_targets = worker_targets.get("crc32")
+    md5_targets = {scheme: worker_targets[scheme] for scheme in ("md5", "md5-tail") if scheme in worker_targets}
+
+    for prefix in prefixes:
+        tried += len(vocabulary)
+        if crc_targets:
+            state = crc32(prefix)
+            if not crc_targets.isdisjoint(map(crc32, vocabulary, repeat(state))):
+                hits += [("crc32", "%08x" % crc32(word, state), prefix + word)
+                         for word in vocabulary if crc32(word, state) in crc_targets]
+        if md5_targets:
+            state = md5(prefix)
+            for word in vocabulary:
+                digest = state.copy()
+                digest.update(word)
+                digest = digest.hexdigest()
+                for scheme, targets in md5_targets.items():
+                    part = digest[:8] if scheme == "md5" else digest[-8:]
+                    if part in targets:
+                        hits.append((scheme, part, prefix + word))
+    return hits, tried
+
+def prefixes(vocabulary, depth, separators):
+    ''' every way to start a candidate of up to depth words '''
+    yield b""
+    for words in range(1, depth):
+        for parts in product(vocabulary, repeat=words):
+            for separator in separators:
+                yield separator.join(parts) + separator
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def recover(unresolved, vocabulary, depth=2, schemes=("crc32",), separators=("_",), jobs=None):
+    ''' {hashed name: [candidates, best first]}, and the candidates/s rate '''
+    hashes = {name.lstrip("$_") for name in unresolved}
+    targets = {scheme: ({int(h, 16) for h in hashes} if scheme == "crc32" else hashes) for scheme in schemes}
+    vocabulary = [word.encode() for word in sorted(vocabulary)]
+    separators = [separator.encode() for separator in separators]
+
+    found = {}
+    tried = 0
+    start = perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs or cpu_count(), initializer=init_worker,
+                             initargs=(vocabulary, targets)) as pool:
+        for hits, count in pool.map(crack, batches(prefixes(vocabulary, depth, separators), 64)):
+            tried += count
+            for scheme, h, candidate in hits:
+                found.setdefault(h, set()).add((scheme, candidate.decode()))
+    rate = tried / (perf_counter() - start)
+
+    # simplest candidates first: fewest words, then shortest
+    candidates = {}
+    for name in unresolved:
+        ranked = sorted(found.get(name.lstrip("$_"), ()),
+                        key=lambda hit: (SCHEMES.index(hit[0]), hit[1].count("_"), len(hit[1]), hit[1]))
+        if ranked:
+            candidates[name] = ranked
+    return candidates, tried, rate
+
+def print_entries(candidates):
+    ''' print fm / vm entries, ready to be pasted into functions_map.py '''
+    for title, names in (("fm", [n for n in candidates if not n.startswith("$")]),
+                         ("vm", [n for n in candidates if n.startswith("$")])):
+        print(f"# {title}")
+        for name in sorted(names):
+            dollar = "$" if name.startswith("$") else ""
+            (scheme, best), others = candidates[name][0], candidates[name][1:]
+            also = ""
+            if others:
+                also = " # also: " + ", ".join(candidate for _, candidate in others[:5])
+            if scheme != "crc32":
+                also = f" # {scheme}" + also.replace(" #", ",")
+            print(f'\t"{name}": "{dollar}{best}",{also}')
+
+def main():
+    parser = ArgumentParser(description="recover the original names behind CNStats' _xxxxxxxx hashes")
+    parser.add_argument("paths", nargs="*", default=["out"], metavar="file.php|dir",
+                        help="decompiled sources to collect hashes and words from (default: out)")
+    parser.add_argument("-w", "--wordlist", action="append", default=[],
+                        help="extra words, one per line")
+    parser.add_argument("-d", "--depth", type=int, default=2,
+                        help="join up to this many words into one candidate (default: 2)")
+    parser.add_argument("-s", "--schemes", default="crc32",
+                        help="comma separated hash schemes to try, of: " + ", ".join(SCHEMES))
+    parser.add_argument("--separators", default="_",
+                        help="characters to join words with (default: _)")
+    parser.add_argument("-m", "--map", action="append", default=[], dest="maps",
+                        help="map file layered over functions_map.py, see maps.py (repeatable)")
+    parser.add_argument("-j", "--jobs", type=int, default=cpu_count(),
+                        help="worker processes (default: cpu count)")
+    args = parser.parse_args()
+
+    schemes = [scheme for scheme in args.schemes.split(",") if scheme]
+    for scheme in schemes:
+        if scheme not in SCHEMES:
+            parser.error(f"unknown hash scheme {scheme}")
+
+    unresolved, vocabulary = collect(args.paths, load_maps(tuple(args.maps)))
+    for wordlist in args.wordlist:
+        with open(wordlist) as f:
+            vocabulary.update(line.strip() for line in f if line.strip())
+    if not unresolved:
+        print("No unresolved names!")
+        return 0
+
+    print(f"# {len(unresolved)} unresolved names, {len(vocabulary)} words, depth {args.depth}")
+    candidates, tried, rate = recover(unresolved, vocabulary, args.depth, schemes,
+                                      list(args.separators) or [""], args.jobs)
+    print(f"# tried {tried} candidates, {rate / 1e6:.1f}M/s, recovered {len(candidates)}/{len(unresolved)}")
+    print_entries(candidates)
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
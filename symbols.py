@@ -0,0 +1,142 @@
+'''
+    symbols.py - a project-wide index of the symbols in a CNStats tree.
+
+    every file is decrypted and lexed once (in parallel), and its names are
+    merged into one index: symbol -> occurrences, per file, where it's
+    defined (for functions), and whether the maps resolve it. names are indexed as they are in
+    the code, so the index stays valid when the maps change: which hashes
+    are still unresolved is worked out again against the maps when it's
+    read:
+
+        python symbols.py index cnstats/ -o symbols.json
+        python symbols.py unresolved -i symbols.json -m extra.json -n 50
+'''
+from argparse import ArgumentParser
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+import os.path
+import json
+
+from cncrypto import HASHED_NAME, decrypt_file, php_files
+from maps import load_maps
+from phplint import T_NEWLINE, T_SPACE, T_STRING, T_VARIABLE, T_WORD, lex, tree
+
+def text_symbols(text):
+    ''' ({symbol: occurrences}, [functions defined]) of decrypted code '''
+    tokens = lex(text)
+    counts = Counter()
+    for index, kind in enumerate(tokens.kinds):
+        if kind == T_VARIABLE or kind == T_WORD:
+            counts[tokens.token_text(index)] += 1
+        elif kind == T_STRING:
+            counts.update(HASHED_NAME.findall(tokens.token_text(index)))
+
+    defined = []
+    for node in tree(tokens).walk():
+        if node.kind == "function":
+            # the first word after 'function', unless it's an anonymous one
+            for index in range(node.start + 1, node.end):
+                kind = tokens.kinds[index]
+                if kind != T_SPACE and kind != T_NEWLINE:
+                    if kind == T_WORD:
+                        defined.append(tokens.token_text(index))
+                    break
+    return counts, defined
+
+def file_symbols(file):
+    ''' (file, {symbol: occurrences}, [functions defined], error) for one
+        file. its variables and words, and the hashed names in its strings
+        (callbacks are often named in one). '''
+    try:
+        text = decrypt_file(file)
+        counts, defined = text_symbols(text)
+    except Exception as excp:
+        return file, {}, [], f"{type(excp).__name__}: {excp}"
+    return file, counts, defined, None
+
+def build_index(paths, maps, jobs=None):
+    ''' {"symbols": {symbol: {"count": n, "files": {file: n}, "resolved":
+        in maps, "defined": [files] (functions only)}}, "errors": {file:
+        error}} of every php file in paths '''
+    symbols = {}
+    errors = {}
+    files = list(php_files(paths))
+    with ProcessPoolExecutor(max_workers=jobs or cpu_count()) as pool:
+        for file, counts, defined, error in pool.map(file_symbols, files, chunksize=8):
+            if error:
+                errors[file] = error
+            for name, count in counts.items():
+                entry = symbols.setdefault(name, {"count": 0, "files": {}})
+                entry["count"] += count
+                entry["files"][file] = count
+            for name in defined:
+                symbols[name].setdefault("defined", []).append(file)
+    for name, entry in symbols.items():
+        entry["resolved"] = is_resolved(name, maps)
+    return {"files": len(files), "symbols": symbols, "errors": errors}
+
+def is_resolved(name, maps):
+    return name in (maps.vm if name.startswith("$") else maps.fm)
+
+def unresolved(index, maps):
+    ''' [(hashed name, occurrences, files)] of the names maps don't
+        resolve, the most used first '''
+    ranked = [(name, entry["count"], len(entry["files"]))
+              for name, entry in index["symbols"].items()
+              if HASHED_NAME.fullmatch(name) and not is_resolved(name, maps)]
+    ranked.sort(key=lambda item: (-item[1], -item[2], item[0]))
+    return ranked
+
+def print_unresolved(index, maps, top=None):
+    ranked = unresolved(index, maps)
+    hashed = sum(1 for name in index["symbols"] if HASHED_NAME.fullmatch(name))
+    print(f"{len(ranked)} of {hashed} hashed names unresolved, in {index['files']} files")
+    if ranked:
+        print(f"{'uses':>7} {'files':>6}  name")
+    for name, count, files in ranked[:top]:
+        print(f"{count:7} {files:6}  {name}")
+
+def save_index(index, path):
+    with open(path + ".tmp", "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def load_index(path):
+    with open(path) as f:
+        return json.load(f)
+
+def main():
+    parser = ArgumentParser(description="index the symbols of a CNStats tree")
+    parser.add_argument("command", choices=("index", "unresolved"))
+    parser.add_argument("paths", nargs="*", metavar="file.php|dir",
+                        help="CNS encrypted or plain php files and directories to index")
+    parser.add_argument("-o", "--output", default="symbols.json",
+                        help="index file to write (default: symbols.json)")
+    parser.add_argument("-i", "--index", default="symbols.json",
+                        help="index file to read, for unresolved (default: symbols.json)")
+    parser.add_argument("-m", "--map", action="append", default=[], dest="maps",
+                        help="map file layered over functions_map.py, see maps.py (repeatable)")
+    parser.add_argument("-n", "--top", type=int, default=30,
+                        help="show this many unresolved names (default: 30, 0 for all)")
+    parser.add_argument("-j", "--jobs", type=int, default=cpu_count(),
+                        help="worker processes (default: cpu count)")
+    args = parser.parse_intermixed_args()
+
+    maps = load_maps(tuple(args.maps))
+    if args.command == "index":
+        if not args.paths:
+            parser.error("index needs the files or directories to index")
+        index = build_index(args.paths, maps, args.jobs)
+        for file, error in sorted(index["errors"].items()):
+            print(f"[FAIL] {file}: {error}")
+        save_index(index, args.output)
+        print(f"{len(index['symbols'])} symbols indexed to {args.output}")
+    else:
+        index = load_index(args.index)
+
+    print_unresolved(index, maps, args.top or None)
+    return 0
+
+if __name__ == "__main__":
+    exit(main())